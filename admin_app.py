@@ -1,326 +1,660 @@
-# -*- coding: utf-8 -*-
-from __future__ import annotations
-
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from functools import lru_cache
+import hashlib
+import hmac
 import os
+import re
+import threading
 import time
-from typing import Any
+from typing import Any, Iterable
 
 from dotenv import load_dotenv
-from flask import Flask, redirect, render_template_string, request, session, url_for
+from flask import Flask, Response, redirect, render_template, request, session, stream_template, url_for
+from jinja2 import DictLoader, select_autoescape
 
 from storage import Storage
 from services.tg_service import TgService
-
-
-def _env(name: str, default: str | None = None) -> str | None:
-    value = os.getenv(name)
-    if value is None or value == "":
-        return default
-    return value
-
-
-def _env_int(name: str, default: int) -> int:
-    value = _env(name)
-    if value is None:
-        return default
-    try:
-        return int(value)
-    except ValueError:
-        return default
-
-
-def create_app() -> Flask:
-    load_dotenv()
-
-    db_path = _env("DATABASE_PATH", os.path.join("data", "taro.db"))
-    admin_token = _env("ADMIN_TOKEN")
-    admin_secret = _env("ADMIN_SECRET_KEY", "change-me")
-    telegram_token = _env("TELEGRAM_BOT_TOKEN")
-    telegram_timeout = _env_int("TELEGRAM_TIMEOUT", 20)
-
-    if not admin_token:
-        raise ValueError("ADMIN_TOKEN is required for admin panel")
-
+import wsgi_server
+
+BROADCAST_LOG_BATCH = 500
+# Telegram drops bulk messages above roughly 30 per second per bot.
+BROADCAST_MAX_RATE = 30
+USERS_PAGE_SIZE = 50
+# Whole comma/whitespace separated tokens made only of ASCII digits.
+_CHAT_ID_RE = re.compile(r"(?<![^\s,])[0-9]+(?![^\s,])")
+
+_ADMIN_CSS = """
+:root {
+  --bg: #f7f4ef;
+  --panel: #ffffff;
+  --ink: #1c1b1a;
+  --muted: #6b6460;
+  --accent: #c56a3a;
+  --border: #e8e0d8;
+}
+* { box-sizing: border-box; }
+body {
+  margin: 0;
+  font-family: "Georgia", "Times New Roman", serif;
+  background: var(--bg);
+  color: var(--ink);
+}
+header {
+  background: var(--panel);
+  border-bottom: 1px solid var(--border);
+  padding: 16px 24px;
+  display: flex;
+  align-items: center;
+  justify-content: space-between;
+  gap: 12px;
+}
+header nav a {
+  margin-right: 16px;
+  text-decoration: none;
+  color: var(--ink);
+  font-weight: 600;
+}
+header nav a:last-child { margin-right: 0; }
+main { padding: 24px; max-width: 1200px; margin: 0 auto; }
+.cards { display: grid; grid-template-columns: repeat(auto-fit, minmax(220px, 1fr)); gap: 16px; }
+.card {
+  background: var(--panel);
+  border: 1px solid var(--border);
+  border-radius: 14px;
+  padding: 16px;
+}
+.muted { color: var(--muted); font-size: 14px; }
+table { width: 100%; border-collapse: collapse; background: var(--panel); border: 1px solid var(--border); }
+th, td { padding: 10px 12px; border-bottom: 1px solid var(--border); text-align: left; }
+th { background: #fbf8f4; font-size: 14px; }
+form .row { display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 12px; }
+input, select, textarea {
+  width: 100%;
+  padding: 8px 10px;
+  border: 1px solid var(--border);
+  border-radius: 8px;
+  background: #fff;
+  font-family: inherit;
+}
+button {
+  padding: 8px 14px;
+  border: none;
+  border-radius: 8px;
+  background: var(--accent);
+  color: white;
+  cursor: pointer;
+  font-weight: 600;
+}
+.actions { display: flex; gap: 8px; flex-wrap: wrap; }
+.message {
+  border: 1px solid var(--border);
+  background: var(--panel);
+  border-radius: 10px;
+  padding: 10px;
+  margin-bottom: 10px;
+}
+.message .meta { font-size: 12px; color: var(--muted); margin-bottom: 6px; }
+.badge {
+  display: inline-block;
+  padding: 2px 8px;
+  border-radius: 999px;
+  background: #f2e7dc;
+  color: #6a3b22;
+  font-size: 12px;
+}
+"""
+# Part of the stylesheet URL, so browsers can cache it until the CSS changes.
+_ADMIN_CSS_VERSION = hashlib.sha256(_ADMIN_CSS.encode("utf-8")).hexdigest()[:12]
+
+_BASE_TEMPLATE = """
+<!doctype html>
+<html lang="ru">
+  <head>
+    <meta charset="utf-8" />
+    <meta name="viewport" content="width=device-width, initial-scale=1" />
+    <title>{{ title }}</title>
+    <link rel="stylesheet" href="{{ url_for('admin_css', v=admin_css_version) }}" />
+  </head>
+  <body>
+    <header>
+      <div><strong>Admin Panel</strong></div>
+      <nav>
+        <a href="{{ url_for('dashboard') }}">Главная</a>
+        <a href="{{ url_for('users') }}">Пользователи</a>
+        <a href="{{ url_for('support') }}">Поддержка</a>
+        <a href="{{ url_for('settings') }}">Настройки</a>
+        <a href="{{ url_for('broadcast') }}">Рассылка</a>
+        <a href="{{ url_for('logout') }}">Выход</a>
+      </nav>
+    </header>
+    <main>
+      {% block content %}{% endblock %}
+    </main>
+  </body>
+</html>
+"""
+
+
+_LOGIN_TEMPLATE = """
+{% extends "base.html" %}
+{% block content %}
+<h1>Вход</h1>
+<form method="post">
+  <div style="max-width: 320px;">
+    <label class="muted">Токен администратора</label>
+    <input type="password" name="token" required />
+    <div style="margin-top: 12px;">
+      <button type="submit">Войти</button>
+    </div>
+  </div>
+</form>
+{% endblock %}
+"""
+
+
+_DASHBOARD_TEMPLATE = """
+{% extends "base.html" %}
+{% block content %}
+<h1>Главная</h1>
+<p class="muted">Период: {{ period }}</p>
+<div class="cards">
+{% for label, value, extra in cards %}
+  <div class="card">
+    <div class="muted">{{ label }}</div>
+    <div style="font-size: 28px;">{{ value }}</div>
+    {% if extra %}<div class="muted">{{ extra }}</div>{% endif %}
+  </div>
+{% endfor %}
+</div>
+{% endblock %}
+"""
+
+
+_USERS_TEMPLATE = """
+{% extends "base.html" %}
+{% block content %}
+<h1>Пользователи</h1>
+<form method="get" style="margin-bottom: 12px;">
+  <div class="row">
+    <div>
+      <input type="text" name="q" placeholder="Поиск по chat_id или имени" value="{{ query }}" />
+    </div>
+    <div>
+      <button type="submit">Найти</button>
+    </div>
+  </div>
+</form>
+<table>
+  <thead>
+    <tr>
+      <th>Chat ID</th>
+      <th>Имя</th>
+      <th>Фамилия</th>
+      <th>Подписка</th>
+      <th>До</th>
+      <th></th>
+    </tr>
+  </thead>
+  <tbody>
+  {% for user in users_list %}
+    <tr>
+      <td>{{ user.chat_id }}</td>
+      <td>{{ user.name or '-' }}</td>
+      <td>{{ user.surname or '-' }}</td>
+      <td>{{ user.subscription or 'free' }}</td>
+      <td>{{ user.subscription_expires_at or '-' }}</td>
+      <td><a href="{{ url_for('user_detail', chat_id=user.chat_id) }}">Детали</a></td>
+    </tr>
+  {% else %}
+    <tr><td colspan="6">Нет данных</td></tr>
+  {% endfor %}
+  </tbody>
+</table>
+{% if page > 1 or has_next %}
+  <div class="actions" style="margin-top: 12px;">
+    {% if page > 1 %}
+      <a href="{{ url_for('users', q=query or None, page=page - 1) }}">&larr; Назад</a>
+    {% endif %}
+    <span class="muted">Страница {{ page }}</span>
+    {% if has_next %}
+      <a href="{{ url_for('users', q=query or None, page=page + 1) }}">Вперёд &rarr;</a>
+    {% endif %}
+  </div>
+{% endif %}
+{% endblock %}
+"""
+
+
+_USER_DETAIL_TEMPLATE = """
+{% extends "base.html" %}
+{% block content %}
+<h1>Пользователь {{ user.chat_id }}</h1>
+<div class="card" style="margin-bottom: 16px;">
+  <form method="post">
+    <div class="row">
+      <div>
+        <label class="muted">Имя</label>
+        <input type="text" name="name" value="{{ user.name or '' }}" />
+      </div>
+      <div>
+        <label class="muted">Фамилия</label>
+        <input type="text" name="surname" value="{{ user.surname or '' }}" />
+      </div>
+      <div>
+        <label class="muted">Дата рождения (YYYY-MM-DD)</label>
+        <input type="text" name="birth_date" value="{{ user.birth_date or '' }}" />
+      </div>
+      <div>
+        <label class="muted">Время рождения (HH:MM:SS)</label>
+        <input type="text" name="birth_time" value="{{ user.birth_time or '' }}" />
+      </div>
+      <div>
+        <label class="muted">Подписка</label>
+        <select name="subscription">
+          <option value="" {% if not user.subscription %}selected{% endif %}>free</option>
+          <option value="paid" {% if user.subscription == 'paid' %}selected{% endif %}>paid</option>
+        </select>
+      </div>
+      <div>
+        <label class="muted">Подписка до (YYYY-MM-DD HH:MM:SS)</label>
+        <input type="text" name="subscription_expires_at" value="{{ user.subscription_expires_at or '' }}" />
+      </div>
+      <div>
+        <label class="muted">Podruzhka free used at</label>
+        <input type="text" name="podruzhka_free_used_at" value="{{ user.podruzhka_free_used_at or '' }}" />
+      </div>
+    </div>
+    <div style="margin-top: 12px;" class="actions">
+      <button type="submit">Сохранить</button>
+    </div>
+  </form>
+</div>
+
+<div class="card" style="margin-bottom: 16px;">
+  <h3>Ответить пользователю</h3>
+  {% if admin_message_result %}
+    <div class="muted" style="margin-bottom: 8px;">{{ admin_message_result }}</div>
+  {% endif %}
+  <form method="post">
+    <textarea name="admin_message" rows="4" placeholder="Текст ответа" required></textarea>
+    <div style="margin-top: 12px;" class="actions">
+      <button type="submit">Отправить</button>
+    </div>
+  </form>
+</div>
+
+<h2>Диалог (последние {{ message_count }})</h2>
+{% for msg in messages %}
+  <div class="message">
+    <div class="meta">
+      <span class="badge">{{ msg['role'] }}</span>
+      {{ msg['created_at'] }}
+    </div>
+    <div>{% if msg['content_html'] is not none %}{{ msg['content_html']|safe }}{% else %}{{ msg['content'] }}{% endif %}</div>
+  </div>
+{% else %}
+  <p>Сообщений нет.</p>
+{% endfor %}
+{% endblock %}
+"""
+
+
+_USER_NOT_FOUND_TEMPLATE = """
+{% extends "base.html" %}
+{% block content %}
+<p>Пользователь не найден.</p>
+{% endblock %}
+"""
+
+
+_SUPPORT_TEMPLATE = """
+{% extends "base.html" %}
+{% block content %}
+<h1>Поддержка</h1>
+<p class="muted">Заявки от пользователей. Чтобы ответить — открой пользователя и отправь сообщение в блоке «Ответить пользователю».</p>
+<table>
+  <thead>
+    <tr>
+      <th>Chat ID</th>
+      <th>Дата</th>
+      <th>Сообщение</th>
+      <th></th>
+    </tr>
+  </thead>
+  <tbody>
+  {% for item in requests_list %}
+    <tr>
+      <td>{{ item.chat_id }}</td>
+      <td>{{ item.created_at }}</td>
+      <td>{{ item.content }}</td>
+      <td><a href="{{ url_for('user_detail', chat_id=item.chat_id) }}">Открыть</a></td>
+    </tr>
+  {% else %}
+    <tr><td colspan="4">Нет заявок</td></tr>
+  {% endfor %}
+  </tbody>
+</table>
+{% endblock %}
+"""
+
+
+_SETTINGS_TEMPLATE = """
+{% extends "base.html" %}
+{% block content %}
+<h1>Настройки</h1>
+<div class="card" style="max-width: 420px;">
+  <form method="post">
+    <label class="muted">Цена подписки (1 месяц), ?</label>
+    <input type="number" name="subscription_price_rub" value="{{ current_price }}" min="1" />
+    <div style="margin-top: 12px;">
+      <button type="submit">Сохранить</button>
+    </div>
+  </form>
+</div>
+{% endblock %}
+"""
+
+
+_BROADCAST_TEMPLATE = """
+{% extends "base.html" %}
+{% block content %}
+<h1>Рассылка</h1>
+{% if result_message %}
+  <div class="card" style="margin-bottom: 12px;">{{ result_message }}</div>
+{% endif %}
+{% if tg is none %}
+  <div class="card" style="margin-bottom: 12px;">
+    <strong>Внимание:</strong> переменная TELEGRAM_BOT_TOKEN не задана.
+  </div>
+{% endif %}
+<form method="post">
+  <div class="card" style="margin-bottom: 16px;">
+    <label class="muted">Сообщение</label>
+    <textarea name="message" rows="5" required>{{ request.form.get('message','') }}</textarea>
+  </div>
+  <div class="card" style="margin-bottom: 16px;">
+    <div class="row">
+      <div>
+        <label class="muted">Кому отправить</label>
+        <select name="mode">
+          <option value="all" {% if request.form.get('mode','all') == 'all' %}selected{% endif %}>Всем</option>
+          <option value="filter" {% if request.form.get('mode') == 'filter' %}selected{% endif %}>По фильтрам</option>
+          <option value="ids" {% if request.form.get('mode') == 'ids' %}selected{% endif %}>По chat_id</option>
+        </select>
+      </div>
+      <div>
+        <label class="muted">Подписка</label>
+        <select name="subscription">
+          <option value="" {% if request.form.get('subscription','') == '' %}selected{% endif %}>Любая</option>
+          <option value="paid" {% if request.form.get('subscription') == 'paid' %}selected{% endif %}>Платные</option>
+          <option value="free" {% if request.form.get('subscription') == 'free' %}selected{% endif %}>Бесплатные</option>
+        </select>
+      </div>
+      <div>
+        <label class="muted">Только активные</label>
+        <div><input type="checkbox" name="active_only" {% if request.form.get('active_only') %}checked{% endif %} /> активная подписка</div>
+      </div>
+      <div>
+        <label class="muted">Лимит получателей</label>
+        <input type="number" name="max_recipients" min="1" value="{{ request.form.get('max_recipients','') }}" />
+      </div>
+      <div>
+        <label class="muted">Задержка (мс)</label>
+        <input type="number" name="delay_ms" min="0" value="{{ request.form.get('delay_ms','50') }}" />
+      </div>
+    </div>
+    <div style="margin-top: 12px;">
+      <label class="muted">Chat ID (для режима "По chat_id")</label>
+      <textarea name="chat_ids" rows="3" placeholder="12345 67890">{{ request.form.get('chat_ids','') }}</textarea>
+    </div>
+    <div style="margin-top: 12px;">
+      <label><input type="checkbox" name="dry_run" {% if request.form.get('dry_run') %}checked{% endif %} /> Только проверить количество (без отправки)</label>
+    </div>
+  </div>
+  <button type="submit">Отправить</button>
+</form>
+{% if recipients_preview %}
+  <p class="muted">Пример получателей: {{ recipients_preview }}</p>
+{% endif %}
+{% endblock %}
+"""
+
+
+_TEMPLATES = {
+    "base.html": _BASE_TEMPLATE,
+    "login.html": _LOGIN_TEMPLATE,
+    "dashboard.html": _DASHBOARD_TEMPLATE,
+    "users.html": _USERS_TEMPLATE,
+    "user_detail.html": _USER_DETAIL_TEMPLATE,
+    "user_not_found.html": _USER_NOT_FOUND_TEMPLATE,
+    "support.html": _SUPPORT_TEMPLATE,
+    "settings.html": _SETTINGS_TEMPLATE,
+    "broadcast.html": _BROADCAST_TEMPLATE,
+}
+
+
+def _env(name: str, default: str | None = None) -> str | None:
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    return value
+
+
+def _env_int(name: str, default: int) -> int:
+    value = _env(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+@lru_cache(maxsize=8)
+def _month_range(year: int, month: int) -> tuple[datetime, datetime]:
+    start = datetime(year, month, 1)
+    if month == 12:
+        end = start.replace(year=year + 1, month=1)
+    else:
+        end = start.replace(month=month + 1)
+    return start, end
+
+
+class _RateLimiter:
+    """Hands out send slots at least ``interval`` seconds apart across threads."""
+
+    def __init__(self, interval: float) -> None:
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+@dataclass(frozen=True, slots=True)
+class AdminSettings:
+    db_path: str
+    admin_token: str
+    admin_secret: str
+    telegram_token: str | None
+    telegram_timeout: int
+    dialog_limit: int
+    support_limit: int
+    dashboard_cache_ttl: int
+    broadcast_workers: int
+    host: str
+    port: int
+    workers: int
+    threads: int
+
+
+def load_admin_settings() -> AdminSettings:
+    load_dotenv()
+
+    admin_token = _env("ADMIN_TOKEN")
+    if not admin_token:
+        raise ValueError("ADMIN_TOKEN is required for admin panel")
+
+    return AdminSettings(
+        db_path=_env("DATABASE_PATH", os.path.join("data", "taro.db")),
+        admin_token=admin_token,
+        admin_secret=_env("ADMIN_SECRET_KEY", "change-me"),
+        telegram_token=_env("TELEGRAM_BOT_TOKEN"),
+        telegram_timeout=_env_int("TELEGRAM_TIMEOUT", 20),
+        dialog_limit=_env_int("ADMIN_DIALOG_LIMIT", 800),
+        support_limit=_env_int("ADMIN_SUPPORT_LIMIT", 200),
+        dashboard_cache_ttl=_env_int("ADMIN_DASHBOARD_CACHE_TTL", 30),
+        broadcast_workers=_env_int("ADMIN_BROADCAST_WORKERS", 8),
+        host=_env("ADMIN_HOST", "127.0.0.1"),
+        port=_env_int("ADMIN_PORT", 8080),
+        workers=_env_int("ADMIN_WORKERS", 2),
+        threads=_env_int("ADMIN_THREADS", 8),
+    )
+
+
+def create_app(config: AdminSettings | None = None) -> Flask:
+    config = config or load_admin_settings()
+
     app = Flask(__name__)
-    app.secret_key = admin_secret
-    storage = Storage(db_path)
-    tg = TgService(telegram_token, timeout=telegram_timeout) if telegram_token else None
-
-    def require_admin() -> bool:
-        return session.get("admin") is True
-
-    def login_required() -> Any:
-        if require_admin():
-            return None
-        return redirect(url_for("login", next=request.path))
-
-    def _month_range(value: datetime) -> tuple[datetime, datetime]:
-        start = value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        if start.month == 12:
-            end = start.replace(year=start.year + 1, month=1)
-        else:
-            end = start.replace(month=start.month + 1)
-        return start, end
-
-    def _clean(value: str | None) -> str | None:
-        if value is None:
-            return None
-        value = value.strip()
-        return value if value else None
-
-    def render_page(title: str, body: str, **context: Any) -> str:
-        template = """
-        <!doctype html>
-        <html lang="ru">
-          <head>
-            <meta charset="utf-8" />
-            <meta name="viewport" content="width=device-width, initial-scale=1" />
-            <title>{{ title }}</title>
-            <style>
-              :root {
-                --bg: #f7f4ef;
-                --panel: #ffffff;
-                --ink: #1c1b1a;
-                --muted: #6b6460;
-                --accent: #c56a3a;
-                --border: #e8e0d8;
-              }
-              * { box-sizing: border-box; }
-              body {
-                margin: 0;
-                font-family: "Georgia", "Times New Roman", serif;
-                background: var(--bg);
-                color: var(--ink);
-              }
-              header {
-                background: var(--panel);
-                border-bottom: 1px solid var(--border);
-                padding: 16px 24px;
-                display: flex;
-                align-items: center;
-                justify-content: space-between;
-                gap: 12px;
-              }
-              header nav a {
-                margin-right: 16px;
-                text-decoration: none;
-                color: var(--ink);
-                font-weight: 600;
-              }
-              header nav a:last-child { margin-right: 0; }
-              main { padding: 24px; max-width: 1200px; margin: 0 auto; }
-              .cards { display: grid; grid-template-columns: repeat(auto-fit, minmax(220px, 1fr)); gap: 16px; }
-              .card {
-                background: var(--panel);
-                border: 1px solid var(--border);
-                border-radius: 14px;
-                padding: 16px;
-              }
-              .muted { color: var(--muted); font-size: 14px; }
-              table { width: 100%; border-collapse: collapse; background: var(--panel); border: 1px solid var(--border); }
-              th, td { padding: 10px 12px; border-bottom: 1px solid var(--border); text-align: left; }
-              th { background: #fbf8f4; font-size: 14px; }
-              form .row { display: grid; grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); gap: 12px; }
-              input, select, textarea {
-                width: 100%;
-                padding: 8px 10px;
-                border: 1px solid var(--border);
-                border-radius: 8px;
-                background: #fff;
-                font-family: inherit;
-              }
-              button {
-                padding: 8px 14px;
-                border: none;
-                border-radius: 8px;
-                background: var(--accent);
-                color: white;
-                cursor: pointer;
-                font-weight: 600;
-              }
-              .actions { display: flex; gap: 8px; flex-wrap: wrap; }
-              .message {
-                border: 1px solid var(--border);
-                background: var(--panel);
-                border-radius: 10px;
-                padding: 10px;
-                margin-bottom: 10px;
-              }
-              .message .meta { font-size: 12px; color: var(--muted); margin-bottom: 6px; }
-              .badge {
-                display: inline-block;
-                padding: 2px 8px;
-                border-radius: 999px;
-                background: #f2e7dc;
-                color: #6a3b22;
-                font-size: 12px;
-              }
-            </style>
-          </head>
-          <body>
-            <header>
-              <div><strong>Admin Panel</strong></div>
-              <nav>
-                <a href="{{ url_for('dashboard') }}">Главная</a>
-                <a href="{{ url_for('users') }}">Пользователи</a>
-                <a href="{{ url_for('support') }}">Поддержка</a>
-                <a href="{{ url_for('settings') }}">Настройки</a>
-                <a href="{{ url_for('broadcast') }}">Рассылка</a>
-                <a href="{{ url_for('logout') }}">Выход</a>
-              </nav>
-            </header>
-            <main>
-              {{ body|safe }}
-            </main>
-          </body>
-        </html>
-        """
-        rendered_body = render_template_string(body, **context)
-        return render_template_string(template, title=title, body=rendered_body, **context)
-
-    @app.route("/login", methods=["GET", "POST"])
-    def login() -> str:
-        if request.method == "POST":
-            token = request.form.get("token", "")
-            if token == admin_token:
-                session["admin"] = True
-                next_url = request.args.get("next") or url_for("dashboard")
-                return redirect(next_url)
-
-        body = """
-        <h1>Вход</h1>
-        <form method="post">
-          <div style="max-width: 320px;">
-            <label class="muted">Токен администратора</label>
-            <input type="password" name="token" required />
-            <div style="margin-top: 12px;">
-              <button type="submit">Войти</button>
-            </div>
-          </div>
-        </form>
-        """
-        return render_page("Вход", body)
-
-    @app.route("/logout")
-    def logout() -> Any:
-        session.clear()
-        return redirect(url_for("login"))
-
-    @app.route("/")
-    def dashboard() -> Any:
-        redirect_response = login_required()
-        if redirect_response:
-            return redirect_response
-
-        now = datetime.now()
-        start, end = _month_range(now)
-        total_users = storage.count_users()
-        new_users = storage.count_new_users_between(start, end)
-        tokens = storage.sum_tokens_between(start, end)
-        active_subs = storage.count_active_subscriptions(now)
-        paid_count, paid_amount = storage.payments_summary_between(start, end)
-
-        body = """
-        <h1>Главная</h1>
-        <p class="muted">Период: {{ start.strftime('%d.%m.%Y') }} – {{ (end - timedelta(seconds=1)).strftime('%d.%m.%Y') }}</p>
-        <div class="cards">
-          <div class="card">
-            <div class="muted">Всего пользователей</div>
-            <div style="font-size: 28px;">{{ total_users }}</div>
-          </div>
-          <div class="card">
-            <div class="muted">Новые пользователи (месяц)</div>
-            <div style="font-size: 28px;">{{ new_users }}</div>
-          </div>
-          <div class="card">
-            <div class="muted">Токены OpenAI (месяц)</div>
-            <div style="font-size: 28px;">{{ tokens }}</div>
-          </div>
-          <div class="card">
-            <div class="muted">Активные подписки</div>
-            <div style="font-size: 28px;">{{ active_subs }}</div>
-          </div>
-          <div class="card">
-            <div class="muted">Оплаты (месяц)</div>
-            <div style="font-size: 28px;">{{ paid_count }}</div>
-            <div class="muted">Сумма: {{ paid_amount }} ?</div>
-          </div>
-        </div>
-        """
-        return render_page(
-            "Главная",
-            body,
-            start=start,
-            end=end,
-            total_users=total_users,
-            new_users=new_users,
-            tokens=tokens,
-            active_subs=active_subs,
-            paid_count=paid_count,
-            paid_amount=paid_amount,
-            timedelta=timedelta,
-        )
-
-    @app.route("/users")
-    def users() -> Any:
-        redirect_response = login_required()
-        if redirect_response:
-            return redirect_response
-
-        query = request.args.get("q") or ""
-        users_list = storage.get_users(search=query or None, limit=300, offset=0)
-
-        body = """
-        <h1>Пользователи</h1>
-        <form method="get" style="margin-bottom: 12px;">
-          <div class="row">
-            <div>
-              <input type="text" name="q" placeholder="Поиск по chat_id или имени" value="{{ query }}" />
-            </div>
-            <div>
-              <button type="submit">Найти</button>
-            </div>
-          </div>
-        </form>
-        <table>
-          <thead>
-            <tr>
-              <th>Chat ID</th>
-              <th>Имя</th>
-              <th>Фамилия</th>
-              <th>Подписка</th>
-              <th>До</th>
-              <th></th>
-            </tr>
-          </thead>
-          <tbody>
-          {% for user in users_list %}
-            <tr>
-              <td>{{ user.chat_id }}</td>
-              <td>{{ user.name or '-' }}</td>
-              <td>{{ user.surname or '-' }}</td>
-              <td>{{ user.subscription or 'free' }}</td>
-              <td>{{ user.subscription_expires_at or '-' }}</td>
-              <td><a href="{{ url_for('user_detail', chat_id=user.chat_id) }}">Детали</a></td>
-            </tr>
-          {% else %}
-            <tr><td colspan="6">Нет данных</td></tr>
-          {% endfor %}
-          </tbody>
-        </table>
-        """
-        return render_page("Пользователи", body, users_list=users_list, query=query)
-
+    # Templates are module constants, so the environment never needs to check them for changes.
+    app.config["TEMPLATES_AUTO_RELOAD"] = False
+    app.jinja_options = {**app.jinja_options, "autoescape": select_autoescape(default=True, default_for_string=True)}
+    app.jinja_loader = DictLoader(_TEMPLATES)
+    app.jinja_env.globals["admin_css_version"] = _ADMIN_CSS_VERSION
+    # Compiled once here; pages render the bound Template objects directly.
+    templates = {name: app.jinja_env.get_template(name) for name in _TEMPLATES}
+    app.secret_key = config.admin_secret
+    app.config.update(SESSION_COOKIE_HTTPONLY=True, SESSION_COOKIE_SAMESITE="Lax")
+    # Keyed with the app secret, so the value in the readable session cookie cannot be checked offline
+    # against guessed tokens; a new token or secret logs every admin out.
+    admin_session_id = hmac.new(
+        config.admin_secret.encode("utf-8"), config.admin_token.encode("utf-8"), hashlib.sha256
+    ).hexdigest()
+    storage = Storage(config.db_path)
+    tg = TgService(config.telegram_token, timeout=config.telegram_timeout) if config.telegram_token else None
+    dashboard_cache: dict[str, tuple[float, str]] = {}
+
+    def require_admin() -> bool:
+        value = session.get("admin")
+        return isinstance(value, str) and hmac.compare_digest(value, admin_session_id)
+
+    def login_required() -> Any:
+        if require_admin():
+            return None
+        return redirect(url_for("login", next=request.path))
+
+    def _dashboard_page(now: datetime) -> str:
+        # The whole rendered page is reused for a few seconds; its numbers change slowly.
+        start, end = _month_range(now.year, now.month)
+        key = start.strftime("%Y%m")
+        cached = dashboard_cache.get(key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+
+        stats = storage.dashboard_summary(start, end, now)
+        cards = [
+            ("Всего пользователей", stats["total_users"], None),
+            ("Новые пользователи (месяц)", stats["new_users"], None),
+            ("Токены OpenAI (месяц)", stats["tokens"], None),
+            ("Активные подписки", stats["active_subs"], None),
+            ("Оплаты (месяц)", stats["paid_count"], f"Сумма: {stats['paid_amount']} ?"),
+        ]
+        page = render_page(
+            "dashboard.html",
+            "Главная",
+            period=f"{start:%d.%m.%Y} – {end - timedelta(seconds=1):%d.%m.%Y}",
+            cards=cards,
+        )
+        if config.dashboard_cache_ttl > 0:
+            dashboard_cache[key] = (time.monotonic() + config.dashboard_cache_ttl, page)
+        return page
+
+    def _clean(value: str | None) -> str | None:
+        if value is None:
+            return None
+        value = value.strip()
+        return value if value else None
+
+    def render_page(template_name: str, title: str, **context: Any) -> str:
+        return render_template(templates[template_name], title=title, **context)
+
+    @app.route("/assets/admin.css")
+    def admin_css() -> Response:
+        response = Response(_ADMIN_CSS, mimetype="text/css")
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+    @app.route("/login", methods=["GET", "POST"])
+    def login() -> str:
+        if request.method == "POST":
+            token = request.form.get("token", "")
+            if token == config.admin_token:
+                session["admin"] = admin_session_id
+                next_url = request.args.get("next") or url_for("dashboard")
+                return redirect(next_url)
+
+        return render_page("login.html", "Вход")
+
+    @app.route("/logout")
+    def logout() -> Any:
+        session.clear()
+        return redirect(url_for("login"))
+
+    @app.route("/")
+    def dashboard() -> Any:
+        redirect_response = login_required()
+        if redirect_response:
+            return redirect_response
+
+        return _dashboard_page(datetime.now())
+
+    @app.route("/users")
+    def users() -> Any:
+        redirect_response = login_required()
+        if redirect_response:
+            return redirect_response
+
+        query = request.args.get("q") or ""
+        page_value = request.args.get("page") or ""
+        page = max(1, int(page_value)) if page_value.isdigit() else 1
+        users_list = storage.get_users(
+            search=query or None,
+            limit=USERS_PAGE_SIZE + 1,
+            offset=(page - 1) * USERS_PAGE_SIZE,
+        )
+        has_next = len(users_list) > USERS_PAGE_SIZE
+        users_list = users_list[:USERS_PAGE_SIZE]
+
+        return render_page(
+            "users.html",
+            "Пользователи",
+            users_list=users_list,
+            query=query,
+            page=page,
+            has_next=has_next,
+        )
+
     @app.route("/users/<int:chat_id>", methods=["GET", "POST"])
     def user_detail(chat_id: int) -> Any:
         redirect_response = login_required()
         if redirect_response:
             return redirect_response
 
+        limit = config.dialog_limit
         user = storage.get_user(chat_id)
         if not user:
-            return render_page("Пользователь", "<p>Пользователь не найден.</p>")
+            return render_page("user_not_found.html", "Пользователь")
 
         admin_message_result = ""
         if request.method == "POST":
@@ -349,85 +683,18 @@ def create_app() -> Flask:
                 user.subscription_expires_at = _clean(request.form.get("subscription_expires_at"))
                 user.podruzhka_free_used_at = _clean(request.form.get("podruzhka_free_used_at"))
                 storage.save_user(user)
-
-        limit = _env_int("ADMIN_DIALOG_LIMIT", 800)
-        messages = storage.get_chat_messages(chat_id, limit=limit)
-
-        body = """
-        <h1>Пользователь {{ user.chat_id }}</h1>
-        <div class="card" style="margin-bottom: 16px;">
-          <form method="post">
-            <div class="row">
-              <div>
-                <label class="muted">Имя</label>
-                <input type="text" name="name" value="{{ user.name or '' }}" />
-              </div>
-              <div>
-                <label class="muted">Фамилия</label>
-                <input type="text" name="surname" value="{{ user.surname or '' }}" />
-              </div>
-              <div>
-                <label class="muted">Дата рождения (YYYY-MM-DD)</label>
-                <input type="text" name="birth_date" value="{{ user.birth_date or '' }}" />
-              </div>
-              <div>
-                <label class="muted">Время рождения (HH:MM:SS)</label>
-                <input type="text" name="birth_time" value="{{ user.birth_time or '' }}" />
-              </div>
-              <div>
-                <label class="muted">Подписка</label>
-                <select name="subscription">
-                  <option value="" {% if not user.subscription %}selected{% endif %}>free</option>
-                  <option value="paid" {% if user.subscription == 'paid' %}selected{% endif %}>paid</option>
-                </select>
-              </div>
-              <div>
-                <label class="muted">Подписка до (YYYY-MM-DD HH:MM:SS)</label>
-                <input type="text" name="subscription_expires_at" value="{{ user.subscription_expires_at or '' }}" />
-              </div>
-              <div>
-                <label class="muted">Podruzhka free used at</label>
-                <input type="text" name="podruzhka_free_used_at" value="{{ user.podruzhka_free_used_at or '' }}" />
-              </div>
-            </div>
-            <div style="margin-top: 12px;" class="actions">
-              <button type="submit">Сохранить</button>
-            </div>
-          </form>
-        </div>
-
-        <div class="card" style="margin-bottom: 16px;">
-          <h3>Ответить пользователю</h3>
-          {% if admin_message_result %}
-            <div class="muted" style="margin-bottom: 8px;">{{ admin_message_result }}</div>
-          {% endif %}
-          <form method="post">
-            <textarea name="admin_message" rows="4" placeholder="Текст ответа" required></textarea>
-            <div style="margin-top: 12px;" class="actions">
-              <button type="submit">Отправить</button>
-            </div>
-          </form>
-        </div>
-
-        <h2>Диалог (последние {{ messages|length }})</h2>
-        {% for msg in messages %}
-          <div class="message">
-            <div class="meta">
-              <span class="badge">{{ msg['role'] }}</span>
-              {{ msg['created_at'] }}
-            </div>
-            <div>{{ msg['content'] }}</div>
-          </div>
-        {% else %}
-          <p>Сообщений нет.</p>
-        {% endfor %}
-        """
-        return render_page(
-            "Пользователь",
-            body,
-            user=user,
-            messages=messages,
-            admin_message_result=admin_message_result,
+                dashboard_cache.clear()
+
+        # Long dialogs are rendered and sent row by row instead of as one string.
+        return Response(
+            stream_template(
+                templates["user_detail.html"],
+                title="Пользователь",
+                user=user,
+                message_count=min(storage.count_chat_messages(chat_id), limit),
+                messages=storage.iter_chat_messages(chat_id, limit=limit),
+                admin_message_result=admin_message_result,
+            )
         )
 
     @app.route("/support")
@@ -436,66 +703,28 @@ def create_app() -> Flask:
         if redirect_response:
             return redirect_response
 
-        limit = _env_int("ADMIN_SUPPORT_LIMIT", 200)
+        limit = config.support_limit
         requests_list = storage.get_support_requests(limit=limit)
 
-        body = """
-        <h1>Поддержка</h1>
-        <p class="muted">Заявки от пользователей. Чтобы ответить — открой пользователя и отправь сообщение в блоке «Ответить пользователю».</p>
-        <table>
-          <thead>
-            <tr>
-              <th>Chat ID</th>
-              <th>Дата</th>
-              <th>Сообщение</th>
-              <th></th>
-            </tr>
-          </thead>
-          <tbody>
-          {% for item in requests_list %}
-            <tr>
-              <td>{{ item.chat_id }}</td>
-              <td>{{ item.created_at }}</td>
-              <td>{{ item.content }}</td>
-              <td><a href="{{ url_for('user_detail', chat_id=item.chat_id) }}">Открыть</a></td>
-            </tr>
-          {% else %}
-            <tr><td colspan="4">Нет заявок</td></tr>
-          {% endfor %}
-          </tbody>
-        </table>
-        """
-        return render_page("Поддержка", body, requests_list=requests_list)
-
-    @app.route("/settings", methods=["GET", "POST"])
-    def settings() -> Any:
-        redirect_response = login_required()
-        if redirect_response:
-            return redirect_response
-
-        if request.method == "POST":
-            price_value = request.form.get("subscription_price_rub", "")
-            try:
-                price_int = int(price_value)
-                if price_int > 0:
-                    storage.set_subscription_price_rub(price_int)
-            except ValueError:
-                pass
-
-        current_price = storage.get_subscription_price_rub()
-        body = """
-        <h1>Настройки</h1>
-        <div class="card" style="max-width: 420px;">
-          <form method="post">
-            <label class="muted">Цена подписки (1 месяц), ?</label>
-            <input type="number" name="subscription_price_rub" value="{{ current_price }}" min="1" />
-            <div style="margin-top: 12px;">
-              <button type="submit">Сохранить</button>
-            </div>
-          </form>
-        </div>
-        """
-        return render_page("Настройки", body, current_price=current_price)
+        return render_page("support.html", "Поддержка", requests_list=requests_list)
+
+    @app.route("/settings", methods=["GET", "POST"])
+    def settings() -> Any:
+        redirect_response = login_required()
+        if redirect_response:
+            return redirect_response
+
+        if request.method == "POST":
+            price_value = request.form.get("subscription_price_rub", "")
+            try:
+                price_int = int(price_value)
+                if price_int > 0:
+                    storage.set_subscription_price_rub(price_int)
+            except ValueError:
+                pass
+
+        current_price = storage.get_subscription_price_rub()
+        return render_page("settings.html", "Настройки", current_price=current_price)
 
     @app.route("/broadcast", methods=["GET", "POST"])
     def broadcast() -> Any:
@@ -530,112 +759,63 @@ def create_app() -> Flask:
                 if not message:
                     result_message = "Сообщение не может быть пустым."
                 else:
-                    recipients: list[int] = []
+                    batches: Iterable[list[int]]
+                    filters: dict[str, Any] = {}
                     if mode == "ids":
-                        tokens = [part.strip() for part in raw_ids.replace(",", " ").split()]
-                        ids: list[int] = []
-                        for token in tokens:
-                            if token.isdigit():
-                                ids.append(int(token))
-                        recipients = list(dict.fromkeys(ids))
+                        ids = list(dict.fromkeys(map(int, _CHAT_ID_RE.findall(raw_ids))))
+                        batches = [ids] if ids else []
                     else:
                         sub_filter = None
                         if subscription in {"paid", "free"}:
                             sub_filter = subscription
-                        recipients = storage.get_recipient_ids(
-                            subscription=sub_filter,
-                            active_only=active_only,
-                            now=datetime.now(),
-                            limit=limit_value,
-                        )
-
-                    recipients_preview = recipients[:10]
+                        filters = {"subscription": sub_filter, "active_only": active_only, "now": datetime.now()}
+                        batches = storage.iter_recipient_ids(**filters, limit=limit_value)
 
-                    if dry_run:
-                        result_message = f"Найдено получателей: {len(recipients)}."
+                    if dry_run and mode != "ids":
+                        total = storage.count_recipients(**filters, limit=limit_value)
+                        preview_limit = min(10, limit_value or 10)
+                        recipients_preview = next(storage.iter_recipient_ids(**filters, limit=preview_limit), [])
+                        result_message = f"Найдено получателей: {total}."
+                    elif dry_run:
+                        total = 0
+                        for batch in batches:
+                            recipients_preview.extend(batch[: 10 - len(recipients_preview)])
+                            total += len(batch)
+                        result_message = f"Найдено получателей: {total}."
                     else:
                         sent = 0
                         failed = 0
-                        for chat_id in recipients:
+
+                        limiter = _RateLimiter(max(delay_value, 1.0 / BROADCAST_MAX_RATE))
+
+                        def send_one(chat_id: int) -> bool:
+                            limiter.wait()
                             try:
-                                tg.send_message(chat_id, message)
-                                storage.log_chat_message(
-                                    chat_id,
-                                    "assistant",
-                                    message,
-                                    meta={"source": "admin_broadcast"},
-                                )
-                                sent += 1
+                                return tg.send_message(chat_id, message) is not None
                             except Exception:
-                                failed += 1
-                            if delay_value > 0:
-                                time.sleep(delay_value)
+                                return False
+
+                        log_meta = {"source": "admin_broadcast"}
+                        pending: list[tuple[int, str, str, dict[str, Any]]] = []
+                        with ThreadPoolExecutor(max_workers=max(1, config.broadcast_workers)) as executor:
+                            for batch in batches:
+                                recipients_preview.extend(batch[: 10 - len(recipients_preview)])
+                                for chat_id, ok in zip(batch, executor.map(send_one, batch)):
+                                    if not ok:
+                                        failed += 1
+                                        continue
+                                    pending.append((chat_id, "assistant", message, log_meta))
+                                    sent += 1
+                                    if len(pending) >= BROADCAST_LOG_BATCH:
+                                        storage.log_chat_messages(pending)
+                                        pending.clear()
+                        storage.log_chat_messages(pending)
 
                         result_message = f"Отправлено: {sent}. Ошибок: {failed}."
 
-        body = """
-        <h1>Рассылка</h1>
-        {% if result_message %}
-          <div class="card" style="margin-bottom: 12px;">{{ result_message }}</div>
-        {% endif %}
-        {% if tg is none %}
-          <div class="card" style="margin-bottom: 12px;">
-            <strong>Внимание:</strong> переменная TELEGRAM_BOT_TOKEN не задана.
-          </div>
-        {% endif %}
-        <form method="post">
-          <div class="card" style="margin-bottom: 16px;">
-            <label class="muted">Сообщение</label>
-            <textarea name="message" rows="5" required>{{ request.form.get('message','') }}</textarea>
-          </div>
-          <div class="card" style="margin-bottom: 16px;">
-            <div class="row">
-              <div>
-                <label class="muted">Кому отправить</label>
-                <select name="mode">
-                  <option value="all" {% if request.form.get('mode','all') == 'all' %}selected{% endif %}>Всем</option>
-                  <option value="filter" {% if request.form.get('mode') == 'filter' %}selected{% endif %}>По фильтрам</option>
-                  <option value="ids" {% if request.form.get('mode') == 'ids' %}selected{% endif %}>По chat_id</option>
-                </select>
-              </div>
-              <div>
-                <label class="muted">Подписка</label>
-                <select name="subscription">
-                  <option value="" {% if request.form.get('subscription','') == '' %}selected{% endif %}>Любая</option>
-                  <option value="paid" {% if request.form.get('subscription') == 'paid' %}selected{% endif %}>Платные</option>
-                  <option value="free" {% if request.form.get('subscription') == 'free' %}selected{% endif %}>Бесплатные</option>
-                </select>
-              </div>
-              <div>
-                <label class="muted">Только активные</label>
-                <div><input type="checkbox" name="active_only" {% if request.form.get('active_only') %}checked{% endif %} /> активная подписка</div>
-              </div>
-              <div>
-                <label class="muted">Лимит получателей</label>
-                <input type="number" name="max_recipients" min="1" value="{{ request.form.get('max_recipients','') }}" />
-              </div>
-              <div>
-                <label class="muted">Задержка (мс)</label>
-                <input type="number" name="delay_ms" min="0" value="{{ request.form.get('delay_ms','50') }}" />
-              </div>
-            </div>
-            <div style="margin-top: 12px;">
-              <label class="muted">Chat ID (для режима "По chat_id")</label>
-              <textarea name="chat_ids" rows="3" placeholder="12345 67890">{{ request.form.get('chat_ids','') }}</textarea>
-            </div>
-            <div style="margin-top: 12px;">
-              <label><input type="checkbox" name="dry_run" {% if request.form.get('dry_run') %}checked{% endif %} /> Только проверить количество (без отправки)</label>
-            </div>
-          </div>
-          <button type="submit">Отправить</button>
-        </form>
-        {% if recipients_preview %}
-          <p class="muted">Пример получателей: {{ recipients_preview }}</p>
-        {% endif %}
-        """
         return render_page(
+            "broadcast.html",
             "Рассылка",
-            body,
             result_message=result_message,
             recipients_preview=recipients_preview,
             tg=tg,
@@ -643,11 +823,12 @@ def create_app() -> Flask:
         )
 
     return app
-
-
-if __name__ == "__main__":
-    load_dotenv()
-    host = _env("ADMIN_HOST", "127.0.0.1")
-    port = _env_int("ADMIN_PORT", 8080)
-    app = create_app()
-    app.run(host=host, port=port, debug=False)
+
+
+def serve(settings: AdminSettings) -> None:
+    wsgi_server.serve(lambda: create_app(settings), settings.host, settings.port, settings.workers, settings.threads)
+
+
+if __name__ == "__main__":
+    serve(load_admin_settings())
+
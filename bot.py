@@ -1,15 +1,30 @@
 from __future__ import annotations
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import logging
+import os
+import queue
+import threading
 import time
 from pathlib import Path
+from typing import Any, Callable, Iterable
 
 from services import AIService, ChatService, TgService, PaymentService
 from settings import load_settings
 from storage import Storage
 
 
+# The offset file is replaced atomically on every change but only fsynced this often.
+OFFSET_FSYNC_EVERY = 10
+# Polling pauses while this many fetched updates are still waiting for their handlers.
+MAX_PENDING_UPDATES = 200
+# Telegram keeps returning unconfirmed updates at once, so while only those come back the poller
+# waits this long (seconds) for a handler to finish instead of spinning.
+PENDING_POLL_INTERVAL = 0.5
+
+
 def _load_offset(path: str | None) -> int:
     if not path:
         return 0
@@ -22,42 +37,178 @@ def _load_offset(path: str | None) -> int:
         return 0
 
 
-def _save_offset(path: str | None, offset: int) -> None:
+def _save_offset(path: str | None, offset: int, *, sync: bool = False) -> None:
     if not path:
         return
-    Path(path).write_text(str(offset), encoding="utf-8")
-
-
-def _send_due_reminders(storage: Storage, tg: TgService, chat: ChatService) -> None:
-    now = datetime.now()
-    for reminder in storage.get_due_reminders(now):
-        if reminder.message.startswith(ChatService.PAYMENT_REMINDER_PREFIX):
-            parts = reminder.message.split("|", 2)
-            if len(parts) >= 2:
-                payment_id = parts[1]
-                if payment_id:
-                    chat.handle_scheduled_payment_check(reminder.chat_id, payment_id)
-            storage.mark_reminder_sent(reminder.id)
-            continue
-
-        if reminder.message in ChatService.RETENTION_MESSAGES:
-            user = storage.get_or_create_user(reminder.chat_id)
-            if user.subscription == "paid" or user.retention_message_sent_at:
-                storage.mark_reminder_sent(reminder.id)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        fh.write(str(offset))
+        if sync:
+            fh.flush()
+            os.fsync(fh.fileno())
+    os.replace(tmp_path, path)
+
+
+def _offset_writer(offsets: queue.Queue[int], path: str | None) -> None:
+    saves = 0
+    while True:
+        offset = offsets.get()
+        saves += 1
+        try:
+            _save_offset(path, offset, sync=saves % OFFSET_FSYNC_EVERY == 0)
+        except OSError as exc:
+            logging.error("Offset save error: %s", exc)
+
+
+def _queue_offset(offsets: queue.Queue[int], offset: int) -> None:
+    # Only the newest offset matters, so an unwritten older one is replaced.
+    try:
+        offsets.put_nowait(offset)
+    except queue.Full:
+        try:
+            offsets.get_nowait()
+        except queue.Empty:
+            pass
+        offsets.put_nowait(offset)
+
+
+class _ChatDispatcher:
+    """Runs each chat's jobs in order on a shared pool; a busy chat never parks a worker."""
+
+    def __init__(self, executor: ThreadPoolExecutor) -> None:
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._progress = threading.Condition(self._lock)
+        # A chat has an entry while one of its jobs is queued or running.
+        self._queues: dict[Any, deque[tuple[Callable[..., None], tuple[Any, ...], tuple[int, ...]]]] = {}
+        self._pending_update_ids: set[int] = set()
+
+    def submit(self, chat_id: Any, fn: Callable[..., None], *args: Any, update_ids: Iterable[int] = ()) -> None:
+        with self._lock:
+            update_ids = tuple(update_ids)
+            self._pending_update_ids.update(update_ids)
+            jobs = self._queues.get(chat_id)
+            if jobs is not None:
+                jobs.append((fn, args, update_ids))
+                return
+            self._queues[chat_id] = deque([(fn, args, update_ids)])
+        self._executor.submit(self._run_next, chat_id)
+
+    def busy(self, chat_id: Any) -> bool:
+        with self._lock:
+            return chat_id in self._queues
+
+    def pending_updates(self) -> int:
+        with self._lock:
+            return len(self._pending_update_ids)
+
+    def oldest_pending_update(self) -> int | None:
+        with self._lock:
+            return min(self._pending_update_ids, default=None)
+
+    def wait_for_progress(self, timeout: float) -> None:
+        with self._progress:
+            self._progress.wait(timeout)
+
+    def _run_next(self, chat_id: Any) -> None:
+        with self._lock:
+            fn, args, update_ids = self._queues[chat_id].popleft()
+        try:
+            fn(*args)
+        except Exception as exc:
+            logging.exception("Chat %s job failed: %s", chat_id, exc)
+        with self._lock:
+            self._pending_update_ids.difference_update(update_ids)
+            self._progress.notify_all()
+            if not self._queues[chat_id]:
+                del self._queues[chat_id]
+                return
+        # Back of the pool queue, so other chats get a turn between this chat's jobs.
+        self._executor.submit(self._run_next, chat_id)
+
+
+def _send_due_reminders(storage: Storage, tg: TgService, chat: ChatService, dispatcher: _ChatDispatcher) -> None:
+    reminders = storage.get_due_reminders(datetime.now())
+    if not reminders:
+        return
+
+    sent_ids: list[int] = []
+    logs: list[tuple[int, str, str, dict[str, Any]]] = []
+    retention_chat_ids: set[int] = set()
+    # A payment check earlier in the batch may have just activated a subscription.
+    payment_chat_ids: set[int] = set()
+
+    # Everything handled so far is written in one transaction, even if a later reminder fails.
+    try:
+        for reminder in reminders:
+            if reminder.message.startswith(ChatService.PAYMENT_REMINDER_PREFIX):
+                parts = reminder.message.split("|", 2)
+                if len(parts) >= 2:
+                    payment_id = parts[1]
+                    if payment_id:
+                        # Queued behind the chat's updates: both rewrite the same session and user rows.
+                        dispatcher.submit(
+                            reminder.chat_id, chat.handle_scheduled_payment_check, reminder.chat_id, payment_id
+                        )
+                        payment_chat_ids.add(reminder.chat_id)
+                sent_ids.append(reminder.id)
+                continue
+
+            is_retention = reminder.message in ChatService.RETENTION_MESSAGES
+            if is_retention and dispatcher.busy(reminder.chat_id):
+                # A queued payment check or update may change the subscription; decide on a later pass.
+                continue
+            subscription = reminder.user_subscription
+            if is_retention and reminder.chat_id in payment_chat_ids:
+                user = storage.get_user(reminder.chat_id)
+                subscription = user.subscription if user else None
+            if is_retention and (
+                subscription == "paid"
+                or reminder.user_retention_sent_at
+                or reminder.chat_id in retention_chat_ids
+            ):
+                sent_ids.append(reminder.id)
                 continue
 
-        tg.send_message(reminder.chat_id, reminder.message)
-        storage.log_chat_message(
-            reminder.chat_id,
-            "assistant",
-            reminder.message,
-            meta={"source": "reminder", "reminder_id": reminder.id},
+            tg.send_message(reminder.chat_id, reminder.message)
+            logs.append(
+                (
+                    reminder.chat_id,
+                    "assistant",
+                    reminder.message,
+                    {"source": "reminder", "reminder_id": reminder.id},
+                )
+            )
+            if is_retention:
+                retention_chat_ids.add(reminder.chat_id)
+            sent_ids.append(reminder.id)
+    finally:
+        storage.mark_reminders_sent(sent_ids, messages=logs, retention_chat_ids=retention_chat_ids)
+
+
+def _handle_chat_updates(chat: ChatService, updates: list[dict[str, Any]]) -> None:
+    for update in updates:
+        try:
+            chat.handle_update(update)
+        except Exception as exc:
+            logging.exception("Update %s failed: %s", update.get("update_id"), exc)
+
+
+def _handle_updates(dispatcher: _ChatDispatcher, chat: ChatService, updates: list[dict[str, Any]]) -> None:
+    # Different chats are handled in parallel; one chat's updates stay in order since they share session state.
+    by_chat: dict[Any, list[dict[str, Any]]] = {}
+    for update in updates:
+        message = update.get("message") or {}
+        by_chat.setdefault((message.get("chat") or {}).get("id"), []).append(update)
+
+    for chat_id, chat_updates in by_chat.items():
+        dispatcher.submit(
+            chat_id,
+            _handle_chat_updates,
+            chat,
+            chat_updates,
+            update_ids=[update["update_id"] for update in chat_updates],
         )
-        if reminder.message in ChatService.RETENTION_MESSAGES:
-            user = storage.get_or_create_user(reminder.chat_id)
-            user.retention_message_sent_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            storage.save_user(user)
-        storage.mark_reminder_sent(reminder.id)
 
 
 def main() -> None:
@@ -74,23 +225,44 @@ def main() -> None:
         timeout=settings.openai_timeout,
     )
     tg = TgService(settings.telegram_token, timeout=settings.telegram_timeout)
-    payments = PaymentService(
-        shop_id=settings.yookassa_shop_id,
-        secret_key=settings.yookassa_secret_key,
-        return_url=settings.yookassa_return_url,
-    )
+    payments = None
+    if settings.yookassa_shop_id:
+        payments = PaymentService(
+            shop_id=settings.yookassa_shop_id,
+            secret_key=settings.yookassa_secret_key,
+            return_url=settings.yookassa_return_url,
+        )
     chat = ChatService(tg=tg, ai=ai, storage=storage, payments=payments)
 
     offset = _load_offset(settings.offset_file)
+    saved_offset = offset
+    # Updates below this id were already handed to the dispatcher; Telegram repeats them until the offset passes them.
+    next_update_id = offset
+    offsets: queue.Queue[int] = queue.Queue(maxsize=1)
+    threading.Thread(target=_offset_writer, args=(offsets, settings.offset_file), daemon=True).start()
+
+    executor = ThreadPoolExecutor(max_workers=max(1, settings.update_workers))
+    dispatcher = _ChatDispatcher(executor)
 
     while True:
         try:
-            updates = tg.get_updates(offset=offset, timeout=settings.polling_timeout)
-            for update in updates:
-                offset = update.get("update_id", offset) + 1
-                chat.handle_update(update)
-            _save_offset(settings.offset_file, offset)
-            _send_due_reminders(storage, tg, chat)
+            if dispatcher.pending_updates() >= MAX_PENDING_UPDATES:
+                dispatcher.wait_for_progress(PENDING_POLL_INTERVAL)
+            else:
+                updates = tg.get_updates(offset=offset, timeout=settings.polling_timeout)
+                fresh = [update for update in updates if update["update_id"] >= next_update_id]
+                if fresh:
+                    next_update_id = fresh[-1]["update_id"] + 1
+                    _handle_updates(dispatcher, chat, fresh)
+                elif updates:
+                    dispatcher.wait_for_progress(PENDING_POLL_INTERVAL)
+            # Telegram drops every update below the offset, so it only moves past updates whose handlers finished.
+            oldest_pending = dispatcher.oldest_pending_update()
+            offset = next_update_id if oldest_pending is None else oldest_pending
+            if offset != saved_offset:
+                _queue_offset(offsets, offset)
+                saved_offset = offset
+            _send_due_reminders(storage, tg, chat, dispatcher)
         except Exception as exc:
             logging.exception("Polling error: %s", exc)
             time.sleep(2)
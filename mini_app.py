@@ -1,11 +1,198 @@
 ﻿# -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import hashlib
 import os
 
 from dotenv import load_dotenv
-from flask import Flask, render_template_string
-
+from flask import Flask, Response, request
+from jinja2 import Environment
+
+from wsgi_server import serve
+
+
+MINI_CSS = """
+:root {
+  --bg-1: #f1eee7;
+  --bg-2: #f8f4ff;
+  --ink: #1b1a18;
+  --muted: #5d5954;
+  --accent: #b04b2f;
+  --accent-2: #355da7;
+  --card: rgba(255, 255, 255, 0.86);
+  --border: rgba(40, 34, 28, 0.12);
+  --glow: rgba(176, 75, 47, 0.18);
+}
+
+* {
+  box-sizing: border-box;
+}
+
+body {
+  margin: 0;
+  font-family: "Cormorant Garamond", "Times New Roman", serif;
+  color: var(--ink);
+  background: radial-gradient(circle at top, rgba(176, 75, 47, 0.18), transparent 60%),
+    radial-gradient(circle at 20% 20%, rgba(53, 93, 167, 0.18), transparent 50%),
+    linear-gradient(140deg, var(--bg-1), var(--bg-2));
+  min-height: 100vh;
+}
+
+.page {
+  padding: 20px 20px 28px;
+  max-width: 880px;
+  margin: 0 auto;
+}
+
+.header {
+  display: grid;
+  grid-template-columns: 64px 1fr;
+  gap: 16px;
+  align-items: center;
+  background: var(--card);
+  border-radius: 22px;
+  border: 1px solid var(--border);
+  padding: 16px 18px;
+  box-shadow: 0 12px 32px rgba(30, 24, 18, 0.12);
+  backdrop-filter: blur(8px);
+}
+
+.avatar {
+  width: 64px;
+  height: 64px;
+  border-radius: 18px;
+  background: linear-gradient(150deg, #f4d7c6, #d7defa);
+  display: grid;
+  place-items: center;
+  font-family: "Manrope", "Segoe UI", sans-serif;
+  font-size: 22px;
+  font-weight: 700;
+  color: #3c2a21;
+  overflow: hidden;
+  border: 1px solid rgba(0, 0, 0, 0.08);
+}
+
+.avatar img {
+  width: 100%;
+  height: 100%;
+  object-fit: cover;
+}
+
+.greeting h1 {
+  margin: 0;
+  font-weight: 600;
+  font-size: 24px;
+}
+
+.greeting p {
+  margin: 6px 0 0;
+  font-family: "Manrope", "Segoe UI", sans-serif;
+  color: var(--muted);
+  font-size: 14px;
+  letter-spacing: 0.01em;
+}
+
+.badge {
+  display: inline-flex;
+  align-items: center;
+  gap: 6px;
+  font-family: "Manrope", "Segoe UI", sans-serif;
+  font-size: 12px;
+  color: #2c2c2c;
+  background: rgba(255, 255, 255, 0.7);
+  border: 1px solid var(--border);
+  border-radius: 999px;
+  padding: 6px 10px;
+  margin-top: 10px;
+}
+
+.badge span {
+  width: 8px;
+  height: 8px;
+  border-radius: 50%;
+  background: #2f9e61;
+  box-shadow: 0 0 8px rgba(47, 158, 97, 0.6);
+}
+
+.panel {
+  margin-top: 22px;
+  background: var(--card);
+  border-radius: 24px;
+  border: 1px solid var(--border);
+  padding: 18px;
+  box-shadow: 0 20px 40px rgba(40, 30, 20, 0.1);
+}
+
+.panel h2 {
+  margin: 0 0 6px;
+  font-size: 20px;
+  font-weight: 600;
+}
+
+.panel p {
+  margin: 0;
+  font-family: "Manrope", "Segoe UI", sans-serif;
+  color: var(--muted);
+  font-size: 14px;
+}
+
+.menu {
+  display: grid;
+  grid-template-columns: repeat(auto-fit, minmax(220px, 1fr));
+  gap: 14px;
+  margin-top: 18px;
+}
+
+.menu button {
+  border: 1px solid var(--border);
+  border-radius: 18px;
+  padding: 16px 18px;
+  background: #fff;
+  text-align: left;
+  font-family: "Manrope", "Segoe UI", sans-serif;
+  font-size: 15px;
+  cursor: default;
+  box-shadow: 0 12px 20px rgba(25, 18, 12, 0.08);
+  transition: transform 0.3s ease, box-shadow 0.3s ease;
+}
+
+.menu button:hover {
+  transform: translateY(-2px);
+  box-shadow: 0 16px 24px rgba(25, 18, 12, 0.12);
+}
+
+.menu span {
+  display: block;
+  font-size: 12px;
+  color: var(--muted);
+  margin-top: 6px;
+}
+
+.footer {
+  margin-top: 22px;
+  font-family: "Manrope", "Segoe UI", sans-serif;
+  font-size: 12px;
+  color: var(--muted);
+  text-align: center;
+}
+
+@media (max-width: 560px) {
+  .header {
+    grid-template-columns: 52px 1fr;
+    padding: 14px;
+  }
+  .avatar {
+    width: 52px;
+    height: 52px;
+    border-radius: 14px;
+  }
+  .greeting h1 {
+    font-size: 20px;
+  }
+}
+"""
+# Part of the stylesheet URL, so browsers can cache it until the CSS changes.
+MINI_CSS_VERSION = hashlib.sha256(MINI_CSS.encode("utf-8")).hexdigest()[:12]
 
 TEMPLATE = """
 <!doctype html>
@@ -16,186 +203,7 @@ TEMPLATE = """
     <meta name="color-scheme" content="light" />
     <title>Таро-бот</title>
     <script src="https://telegram.org/js/telegram-web-app.js"></script>
-    <style>
-      :root {
-        --bg-1: #f1eee7;
-        --bg-2: #f8f4ff;
-        --ink: #1b1a18;
-        --muted: #5d5954;
-        --accent: #b04b2f;
-        --accent-2: #355da7;
-        --card: rgba(255, 255, 255, 0.86);
-        --border: rgba(40, 34, 28, 0.12);
-        --glow: rgba(176, 75, 47, 0.18);
-      }
-
-      * {
-        box-sizing: border-box;
-      }
-
-      body {
-        margin: 0;
-        font-family: "Cormorant Garamond", "Times New Roman", serif;
-        color: var(--ink);
-        background: radial-gradient(circle at top, rgba(176, 75, 47, 0.18), transparent 60%),
-          radial-gradient(circle at 20% 20%, rgba(53, 93, 167, 0.18), transparent 50%),
-          linear-gradient(140deg, var(--bg-1), var(--bg-2));
-        min-height: 100vh;
-      }
-
-      .page {
-        padding: 20px 20px 28px;
-        max-width: 880px;
-        margin: 0 auto;
-      }
-
-      .header {
-        display: grid;
-        grid-template-columns: 64px 1fr;
-        gap: 16px;
-        align-items: center;
-        background: var(--card);
-        border-radius: 22px;
-        border: 1px solid var(--border);
-        padding: 16px 18px;
-        box-shadow: 0 12px 32px rgba(30, 24, 18, 0.12);
-        backdrop-filter: blur(8px);
-      }
-
-      .avatar {
-        width: 64px;
-        height: 64px;
-        border-radius: 18px;
-        background: linear-gradient(150deg, #f4d7c6, #d7defa);
-        display: grid;
-        place-items: center;
-        font-family: "Manrope", "Segoe UI", sans-serif;
-        font-size: 22px;
-        font-weight: 700;
-        color: #3c2a21;
-        overflow: hidden;
-        border: 1px solid rgba(0, 0, 0, 0.08);
-      }
-
-      .avatar img {
-        width: 100%;
-        height: 100%;
-        object-fit: cover;
-      }
-
-      .greeting h1 {
-        margin: 0;
-        font-weight: 600;
-        font-size: 24px;
-      }
-
-      .greeting p {
-        margin: 6px 0 0;
-        font-family: "Manrope", "Segoe UI", sans-serif;
-        color: var(--muted);
-        font-size: 14px;
-        letter-spacing: 0.01em;
-      }
-
-      .badge {
-        display: inline-flex;
-        align-items: center;
-        gap: 6px;
-        font-family: "Manrope", "Segoe UI", sans-serif;
-        font-size: 12px;
-        color: #2c2c2c;
-        background: rgba(255, 255, 255, 0.7);
-        border: 1px solid var(--border);
-        border-radius: 999px;
-        padding: 6px 10px;
-        margin-top: 10px;
-      }
-
-      .badge span {
-        width: 8px;
-        height: 8px;
-        border-radius: 50%;
-        background: #2f9e61;
-        box-shadow: 0 0 8px rgba(47, 158, 97, 0.6);
-      }
-
-      .panel {
-        margin-top: 22px;
-        background: var(--card);
-        border-radius: 24px;
-        border: 1px solid var(--border);
-        padding: 18px;
-        box-shadow: 0 20px 40px rgba(40, 30, 20, 0.1);
-      }
-
-      .panel h2 {
-        margin: 0 0 6px;
-        font-size: 20px;
-        font-weight: 600;
-      }
-
-      .panel p {
-        margin: 0;
-        font-family: "Manrope", "Segoe UI", sans-serif;
-        color: var(--muted);
-        font-size: 14px;
-      }
-
-      .menu {
-        display: grid;
-        grid-template-columns: repeat(auto-fit, minmax(220px, 1fr));
-        gap: 14px;
-        margin-top: 18px;
-      }
-
-      .menu button {
-        border: 1px solid var(--border);
-        border-radius: 18px;
-        padding: 16px 18px;
-        background: #fff;
-        text-align: left;
-        font-family: "Manrope", "Segoe UI", sans-serif;
-        font-size: 15px;
-        cursor: default;
-        box-shadow: 0 12px 20px rgba(25, 18, 12, 0.08);
-        transition: transform 0.3s ease, box-shadow 0.3s ease;
-      }
-
-      .menu button:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 16px 24px rgba(25, 18, 12, 0.12);
-      }
-
-      .menu span {
-        display: block;
-        font-size: 12px;
-        color: var(--muted);
-        margin-top: 6px;
-      }
-
-      .footer {
-        margin-top: 22px;
-        font-family: "Manrope", "Segoe UI", sans-serif;
-        font-size: 12px;
-        color: var(--muted);
-        text-align: center;
-      }
-
-      @media (max-width: 560px) {
-        .header {
-          grid-template-columns: 52px 1fr;
-          padding: 14px;
-        }
-        .avatar {
-          width: 52px;
-          height: 52px;
-          border-radius: 14px;
-        }
-        .greeting h1 {
-          font-size: 20px;
-        }
-      }
-    </style>
+    <link rel="stylesheet" href="/assets/mini.css?v={{ css_version }}" />
   </head>
   <body>
     <div class="page">
@@ -270,20 +278,41 @@ TEMPLATE = """
 </html>
 """
 
+# The page only depends on the stylesheet version, so it is rendered once at import:
+# gunicorn workers forked from the master inherit it instead of compiling it again.
+PAGE = Environment(autoescape=True).from_string(TEMPLATE).render(css_version=MINI_CSS_VERSION)
+PAGE_ETAG = hashlib.sha256(PAGE.encode("utf-8")).hexdigest()[:16]
+
 
 def create_app() -> Flask:
     load_dotenv()
     app = Flask(__name__)
 
     @app.get("/")
-    def index() -> str:
-        return render_template_string(TEMPLATE)
+    def index() -> Response:
+        if request.if_none_match.contains(PAGE_ETAG):
+            response = Response(status=304)
+        else:
+            response = Response(PAGE, mimetype="text/html")
+        response.set_etag(PAGE_ETAG)
+        response.headers["Cache-Control"] = "public, max-age=300"
+        return response
+
+    @app.get("/assets/mini.css")
+    def mini_css() -> Response:
+        response = Response(MINI_CSS, mimetype="text/css")
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
 
     return app
 
 
 if __name__ == "__main__":
     load_dotenv()
-    host = os.getenv("MINI_APP_HOST", "127.0.0.1")
-    port = int(os.getenv("MINI_APP_PORT", "8090"))
-    create_app().run(host=host, port=port)
+    serve(
+        create_app,
+        os.getenv("MINI_APP_HOST", "127.0.0.1"),
+        int(os.getenv("MINI_APP_PORT", "8090")),
+        int(os.getenv("MINI_APP_WORKERS", "1")),
+        int(os.getenv("MINI_APP_THREADS", "8")),
+    )
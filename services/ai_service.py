@@ -1,14 +1,69 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from collections import OrderedDict
+from functools import lru_cache
+import json
 import logging
-from typing import Any
+import socket
+import threading
+import time
+from typing import Any, Callable, Iterator, NamedTuple
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.util.retry import Retry
 
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib codec
+    orjson = None
 
-@dataclass(frozen=True)
-class AIResponse:
+
+RESPONSE_CACHE_SIZE = 512
+PAYLOAD_PREFIX_CACHE_SIZE = 32
+RESPONSE_CACHE_TTL = 600.0
+# Above this temperature repeated prompts are expected to get different answers, so nothing is cached.
+RESPONSE_CACHE_MAX_TEMPERATURE = 0.3
+# Probe idle pooled sockets well before the API edge drops them (~60s) so dead ones are noticed before reuse.
+KEEPALIVE_IDLE = 30
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+
+
+def _json_dumps(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+def _json_loads(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _keepalive_socket_options() -> list[tuple[int, int, int]]:
+    options = [*HTTPConnection.default_socket_options, (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    # The per-socket timers are not available on every platform.
+    for name, value in (
+        ("TCP_KEEPIDLE", KEEPALIVE_IDLE),
+        ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL),
+        ("TCP_KEEPCNT", KEEPALIVE_COUNT),
+    ):
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return options
+
+
+class _KeepAliveAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        kwargs.setdefault("socket_options", _keepalive_socket_options())
+        super().init_poolmanager(*args, **kwargs)
+
+
+# Immutable because cached responses are shared between callers.
+class AIResponse(NamedTuple):
     content: str
     usage: dict[str, int] | None
     model: str | None
@@ -31,50 +86,189 @@ class AIService:
         self._max_tokens = max_tokens
         self._base_url = base_url.rstrip("/")
         self._timeout = timeout
+        self._completions_url = f"{self._base_url}/chat/completions"
+        # Per-call payloads only add "messages" on top of this.
+        self._base_payload: dict[str, Any] = {
+            "model": self._model,
+            "temperature": self._temperature,
+            "max_tokens": self._max_tokens,
+        }
+        # Serialized payload up to the user message, per system prompt; bots mostly reuse a few fixed personas.
+        self._payload_prefix = lru_cache(maxsize=PAYLOAD_PREFIX_CACHE_SIZE)(self._build_payload_prefix)
+        # get_answer results keyed by (system message, message); model and temperature are fixed per instance.
+        self._cache_enabled = temperature <= RESPONSE_CACHE_MAX_TEMPERATURE
+        self._cache: OrderedDict[tuple[str, str], tuple[float, AIResponse]] = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # One keep-alive pool for every completion call; auth headers are set once here.
+        self._session = requests.Session()
+        self._session.headers.update(
+            {
+                "Authorization": f"Bearer {self._api_key}",
+                "Content-Type": "application/json",
+            }
+        )
+        # Completions are not idempotent: only retry when the request surely was not processed (the
+        # connection never opened, or the API turned it away); a read timeout may mean it is still running.
+        retry = Retry(
+            total=2,
+            connect=2,
+            read=0,
+            other=0,
+            status=2,
+            backoff_factor=0.2,
+            status_forcelist=(429, 503),
+            allowed_methods=frozenset({"POST"}),
+            raise_on_status=False,
+        )
+        self._session.mount("https://", _KeepAliveAdapter(pool_connections=4, pool_maxsize=32, max_retries=retry))
+
+    def close(self) -> None:
+        self._session.close()
 
     def get_answer(self, message: str, system_message: str | None = None) -> AIResponse:
+        # A blank prompt can only produce a useless answer; fail before spending a round trip on it.
+        if not message or message.isspace():
+            raise ValueError("Empty prompt")
+        if not self._cache_enabled:
+            return self._post_completion(self._prompt_body(message, system_message))
+
+        # Whitespace-only differences (trailing newlines, double spaces) still hit the same entry.
+        key = (system_message or "", " ".join(message.split()))
+        now = time.monotonic()
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] > now:
+                self._cache.move_to_end(key)
+                # A cached answer cost no tokens, so it must not be counted again.
+                return cached[1]._replace(usage=None)
+
+        response = self._post_completion(self._prompt_body(message, system_message))
+        with self._cache_lock:
+            self._cache[key] = (now + RESPONSE_CACHE_TTL, response)
+            self._cache.move_to_end(key)
+            while len(self._cache) > RESPONSE_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return response
+
+    def get_answer_streaming(
+        self,
+        message: str,
+        system_message: str | None = None,
+        *,
+        on_progress: Callable[[str], None],
+        max_chars: int | None = None,
+    ) -> AIResponse:
+        # on_progress gets the text received so far after every chunk. Past max_chars further text is
+        # ignored, but the stream is still read to the end for the usage chunk that closes it.
+        payload = {
+            **self._base_payload,
+            "messages": self._build_messages(message, system_message),
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+        parts: list[str] = []
+        length = 0
+        usage: dict[str, int] | None = None
+        model: str | None = None
+        truncated = False
+        for event in self._stream_events(payload):
+            model = event.get("model") or model
+            if event.get("usage"):
+                usage = self._extract_usage(event)
+            if truncated:
+                continue
+            received = length
+            for choice in event.get("choices") or []:
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    parts.append(content)
+                    length += len(content)
+            if length == received:
+                continue
+            on_progress("".join(parts))
+            truncated = max_chars is not None and length > max_chars
+
+        content = "".join(parts).strip()
+        if not content:
+            raise RuntimeError("Empty response from OpenAI")
+        return AIResponse(content=content, usage=usage, model=model or self._model)
+
+    def _stream_events(self, payload: dict[str, Any]) -> Iterator[dict[str, Any]]:
+        with self._session.post(
+            self._completions_url,
+            data=_json_dumps(payload),
+            timeout=self._timeout,
+            stream=True,
+        ) as response:
+            if response.status_code >= 400:
+                logging.warning("OpenAI API failed: status=%s body=%.512s", response.status_code, response.text)
+                raise RuntimeError("OpenAI API request failed")
+
+            # Server-sent events: one "data: {json}" line per chunk, closed by "data: [DONE]".
+            for line in response.iter_lines(chunk_size=None):
+                if not line.startswith(b"data: "):
+                    continue
+                chunk = line[6:]
+                if chunk == b"[DONE]":
+                    break
+                yield _json_loads(chunk)
+
+    def chat_with_context(self, messages: list[dict[str, str]]) -> AIResponse:
+        try:
+            return self._complete(messages)
+        except Exception:
+            return AIResponse(
+                content="Сейчас мне сложно поддержать диалог, попробуй чуть позже.",
+                usage=None,
+                model=self._model,
+            )
+
+    @staticmethod
+    def _build_messages(message: str, system_message: str | None) -> list[dict[str, Any]]:
         messages: list[dict[str, Any]] = []
 
         if system_message:
             messages.append({"role": "system", "content": system_message})
 
         messages.append({"role": "user", "content": message})
+        return messages
 
-        payload = {
-            "model": self._model,
-            "messages": messages,
-            "temperature": self._temperature,
-            "max_tokens": self._max_tokens,
-        }
+    def _build_payload_prefix(self, system_message: str) -> bytes:
+        # Everything before the user message: the base payload with an open "messages" array.
+        prefix = _json_dumps({**self._base_payload, "messages": []})[:-2]
+        if system_message:
+            prefix += _json_dumps({"role": "system", "content": system_message}) + b","
+        return prefix
+
+    def _prompt_body(self, message: str, system_message: str | None) -> bytes:
+        return self._payload_prefix(system_message or "") + _json_dumps({"role": "user", "content": message}) + b"]}"
 
+    def _complete(self, messages: list[dict[str, Any]]) -> AIResponse:
+        return self._post_completion(_json_dumps({**self._base_payload, "messages": messages}))
+
+    def _post_completion(self, body: bytes) -> AIResponse:
         try:
-            response = requests.post(
-                f"{self._base_url}/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self._api_key}",
-                    "Content-Type": "application/json",
-                },
-                json=payload,
+            response = self._session.post(
+                self._completions_url,
+                data=body,
                 timeout=self._timeout,
             )
 
             if response.status_code >= 400:
-                logging.warning(
-                    "OpenAI API failed",
-                    extra={"status": response.status_code, "body": response.text},
-                )
+                logging.warning("OpenAI API failed: status=%s body=%.512s", response.status_code, response.text)
                 raise RuntimeError("OpenAI API request failed")
 
-            data = response.json()
+            data = _json_loads(response.content)
         except Exception as exc:
             logging.warning("OpenAI API error: %s", exc)
             raise
 
-        logging.info("OpenAI response: %s", data)
+        self._log_response(data)
 
         try:
             content = data["choices"][0]["message"]["content"].strip()
-        except (KeyError, IndexError, AttributeError) as exc:
+        except (KeyError, IndexError, AttributeError, TypeError) as exc:
+            logging.warning("OpenAI API error: %s", exc)
             raise RuntimeError("Empty response from OpenAI") from exc
 
         return AIResponse(
@@ -83,46 +277,33 @@ class AIService:
             model=data.get("model") or self._model,
         )
 
-    def chat_with_context(self, messages: list[dict[str, str]]) -> AIResponse:
-        payload = {
-            "model": self._model,
-            "messages": messages,
-            "temperature": self._temperature,
-            "max_tokens": self._max_tokens,
-        }
-
-        try:
-            response = requests.post(
-                f"{self._base_url}/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {self._api_key}",
-                    "Content-Type": "application/json",
-                },
-                json=payload,
-                timeout=self._timeout,
-            )
-
-            data = response.json()
-
-            logging.info("OpenAI response: %s", data)
-
-            content = data["choices"][0]["message"]["content"].strip()
-            return AIResponse(
-                content=content,
-                usage=self._extract_usage(data),
-                model=data.get("model") or self._model,
-            )
-        except Exception as exc:
-            logging.warning("OpenAI API error: %s", exc)
-            return AIResponse(
-                content="Сейчас мне сложно поддержать диалог, попробуй чуть позже.",
-                usage=None,
-                model=self._model,
-            )
+    @staticmethod
+    def _log_response(data: dict[str, Any]) -> None:
+        # Stringifying the whole completion on every call is only worth it when debugging.
+        logging.info("OpenAI response: id=%s model=%s usage=%s", data.get("id"), data.get("model"), data.get("usage"))
+        logging.debug("OpenAI response body: %s", data)
 
     @staticmethod
     def _extract_usage(data: dict[str, Any]) -> dict[str, int] | None:
         usage_raw = data.get("usage")
+        if usage_raw is None:
+            return None
+
+        # Fast path for the regular OpenAI shape: all three counters present as ints.
+        try:
+            prompt_tokens = usage_raw["prompt_tokens"]
+            completion_tokens = usage_raw["completion_tokens"]
+            total_tokens = usage_raw["total_tokens"]
+        except (KeyError, TypeError):
+            pass
+        else:
+            if type(prompt_tokens) is int and type(completion_tokens) is int and type(total_tokens) is int:
+                return {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": total_tokens,
+                }
+
         if not isinstance(usage_raw, dict):
             return None
         usage: dict[str, int] = {}
@@ -1,9 +1,11 @@
 from __future__ import annotations
 
-from datetime import datetime, timedelta
-import calendar
+from dataclasses import replace
+from datetime import date, datetime, timedelta
 import logging
 import re
+import threading
+import time
 from typing import Any
 
 from storage import Storage, TgSession, User
@@ -12,6 +14,53 @@ from .tg_service import TgService
 from .payment_service import PaymentService
 
 
+# First day of each sign; anything before 20 January is still Capricorn.
+_ZODIAC_STARTS = (
+    (1, 20, "Водолей"),
+    (2, 19, "Рыбы"),
+    (3, 21, "Овен"),
+    (4, 20, "Телец"),
+    (5, 21, "Близнецы"),
+    (6, 21, "Рак"),
+    (7, 23, "Лев"),
+    (8, 23, "Дева"),
+    (9, 23, "Весы"),
+    (10, 23, "Скорпион"),
+    (11, 22, "Стрелец"),
+    (12, 22, "Козерог"),
+)
+
+
+def _build_zodiac_table() -> tuple[str, ...]:
+    # Indexed by month * 32 + day.
+    table = ["Козерог"] * (13 * 32)
+    for month, day, sign in _ZODIAC_STARTS:
+        start = month * 32 + day
+        table[start:] = [sign] * (len(table) - start)
+    return tuple(table)
+
+
+_ZODIAC_BY_DAY = _build_zodiac_table()
+_DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def _split_birth_date(value: str) -> tuple[int, int, int]:
+    # The bot stores zero-padded YYYY-MM-DD, which is sliced directly; admin edits are free text
+    # (e.g. "1990-1-5"), so anything else goes through strptime and may raise ValueError.
+    if (
+        len(value) == 10
+        and value[4] == value[7] == "-"
+        and value[:4].isdecimal()
+        and value[5:7].isdecimal()
+        and value[8:].isdecimal()
+    ):
+        year, month, day = int(value[:4]), int(value[5:7]), int(value[8:])
+        if 1 <= month <= 12 and 1 <= day <= _DAYS_IN_MONTH[month - 1] + (month == 2):
+            return year, month, day
+    parsed = datetime.strptime(value, "%Y-%m-%d")
+    return parsed.year, parsed.month, parsed.day
+
+
 class ChatService:
     PAYMENT_REMINDER_PREFIX = "__PAYMENT_CHECK__"
     RETENTION_MESSAGES = (
@@ -43,18 +92,76 @@ class ChatService:
         "Сделать ещё расклад",
         "В меню",
     }
+    _MAIN_MENU_KEYBOARD = [
+        ["🃏 Расклад Таро", "🃏 Режим таролога"],
+        ["🔢 Нумерология", "♒ Гороскоп"],
+        ["💬 Подружка", "💎 Подписка"],
+        ["ℹ️ Помощь"],
+    ]
+    # Without a payment provider there is nothing to subscribe to, so the entry is hidden.
+    _MAIN_MENU_KEYBOARD_NO_PAYMENTS = [
+        ["🃏 Расклад Таро", "🃏 Режим таролога"],
+        ["🔢 Нумерология", "♒ Гороскоп"],
+        ["💬 Подружка", "ℹ️ Помощь"],
+    ]
+    PAYMENTS_UNAVAILABLE_TEXT = "Оплата подписки сейчас недоступна. Попробуй позже или напиши в поддержку."
+    # Subscription button -> months.
+    _SUBSCRIPTION_PLANS = {"1 месяц": 1, "6 месяцев (-10%)": 6, "12 месяцев (-10%)": 12}
+    _SUBSCRIPTION_KEYBOARD = [["1 месяц", "6 месяцев (-10%)"], ["12 месяцев (-10%)", "Назад в меню"]]
     _SURNAME_RE = re.compile(r"^[A-Za-zА-Яа-яЁё\\-\\s']{2,100}$")
+    _DATE_RE = re.compile(r"\d{2}\.\d{2}\.\d{4}")
+    _TIME_RE = re.compile(r"\d{2}:\d{2}")
+    _POSITIVE_ANSWERS = frozenset({"старт", "да", "ok", "okey", "начать", "start", "давай", "готово"})
+    _DISTRESS_WORDS = ("суиц", "самоуб", "убью", "смерть", "умереть")
+    _DISTRESS_RE = re.compile("|".join(map(re.escape, _DISTRESS_WORDS)))
     PODRUZHKA_DAILY_LIMIT = 30
     PODRUZHKA_MAX_INPUT_CHARS = 1000
     PODRUZHKA_MAX_REPLY_CHARS = 1200
     TAROT_MODE_FREE_DAILY_LIMIT = 1
     TAROT_MODE_PAID_DAILY_LIMIT = 5
+    # Sent as its own system message so every taro request starts with the same bytes; only the
+    # request details in build_taro_prompt vary. Editing this text invalidates provider-side prompt caches.
+    TARO_SYSTEM_PROMPT = (
+        "Ты — нежный и заботливый таролог, говоришь мягко и поддерживающе. Отвечай по-русски.\n\n"
+        "Дай название каждой карты (если возможно), краткую интерпретацию до 400 символов для каждой карты и общий вывод по раскладу (до 400 символов). "
+        "Стиль: мягкий, поддерживающий, без категоричных предсказаний. В конце предложи 2-3 уточняющих вопроса, которые пользователь может задать для более точного ответа."
+    )
+    # Telegram rate-limits edits, so the streamed preview is refreshed at most this often (seconds).
+    AI_PREVIEW_EDIT_INTERVAL = 1.0
 
-    def __init__(self, tg: TgService, ai: AIService, storage: Storage, payments: PaymentService) -> None:
+    def __init__(self, tg: TgService, ai: AIService, storage: Storage, payments: PaymentService | None) -> None:
         self.tg = tg
         self.ai = ai
         self.storage = storage
         self.payments = payments
+        self._main_menu_keyboard = self._MAIN_MENU_KEYBOARD if payments is not None else self._MAIN_MENU_KEYBOARD_NO_PAYMENTS
+        # Short daily horoscope per sign: (date, response); shared by every user of that sign for the day.
+        self._daily_horoscopes: dict[str, tuple[str, AIResponse]] = {}
+        self._daily_horoscopes_lock = threading.Lock()
+        # Conversation state -> handler; states not listed here fall back to handle_unknown_state.
+        self._state_handlers = {
+            "start": self.handle_start,
+            "ask_consent": self.handle_consent,
+            "ask_name": self.handle_name,
+            "ask_birth_date": self.handle_birth_date,
+            "main_menu": self.route_main_menu,
+            "taro_menu": self.route_taro_menu,
+            "taro_ask_question": self.handle_taro_question,
+            "tarot_mode_topic": self.handle_tarot_mode_topic,
+            "tarot_mode_timeframe": self.handle_tarot_mode_timeframe,
+            "tarot_mode_cards": self.handle_tarot_mode_cards,
+            "tarot_mode_done": self.handle_tarot_mode_done,
+            "numerology_ask_surname": self.handle_numerology_surname,
+            "numerology_menu": self.route_numerology_menu,
+            "horoscope_ask_surname": self.handle_horoscope_surname,
+            "horoscope_ask_birth_time": self.handle_horoscope_birth_time,
+            "horoscope_menu": self.route_horoscope_menu,
+            "podruzhka_free": self.handle_podruzhka_free,
+            "podruzhka_chat": self.handle_podruzhka_chat,
+            "subscription_menu": self.route_subscription_menu,
+            "await_payment": self.handle_payment_status,
+            "support_ask": self.handle_support_request,
+        }
 
     def send_message(
         self,
@@ -63,12 +170,13 @@ class ChatService:
         keyboard: list[list[str]] | None = None,
         *,
         meta: dict[str, Any] | None = None,
-    ) -> None:
+    ) -> int | None:
         payload_meta = dict(meta or {})
         if keyboard:
             payload_meta.setdefault("keyboard", keyboard)
-        self.tg.send_message(chat_id, text, keyboard)
+        message_id = self.tg.send_message(chat_id, text, keyboard)
         self.storage.log_chat_message(chat_id, "assistant", text, meta=payload_meta)
+        return message_id
 
     def handle_update(self, update: dict) -> None:
         message = update.get("message")
@@ -93,174 +201,135 @@ class ChatService:
 
         session = self.storage.get_or_create_session(chat_id)
         user = self.storage.get_or_create_user(chat_id)
+        snapshot = self._snapshot(session, user)
 
-        match session.state:
-            case "start":
-                self.show_welcome(chat_id)
-                session.state = "ask_consent"
-
-            case "ask_consent":
-                if self.is_positive(text):
-                    self.send_message(
-                        chat_id,
-                        "Спасибо ❤️\nПожалуйста, укажи своё имя (Напиши имя, чтобы я могла к тебе обращаться):",
-                    )
-                    session.state = "ask_name"
-                else:
-                    self.send_message(
-                        chat_id,
-                        "Нажми «Старт», когда будешь готова начать.",
-                        [["Старт"]],
-                    )
+        self._state_handlers.get(session.state, self.handle_unknown_state)(session, user, chat_id, text)
+        self._save_changed(session, user, snapshot)
 
-            case "ask_name":
-                if not text:
-                    self.send_message(chat_id, "Пожалуйста, напиши имя (например: Анна).")
-                else:
-                    user.name = text[:100]
-                    self.send_message(
-                        chat_id,
-                        f"Приятно познакомиться, {user.name}! Теперь, пожалуйста, введи дату рождения в формате ДД.MM.ГГГГ",
-                    )
-                    session.state = "ask_birth_date"
+    def handle_start(self, session: TgSession, user: User, chat_id: int, text: str) -> None:
+        self.show_welcome(chat_id)
+        session.state = "ask_consent"
 
-            case "ask_birth_date":
-                if not self.validate_date(text):
-                    self.send_message(
-                        chat_id,
-                        "Неверный формат даты. Введите, пожалуйста, в формате ДД.MM.ГГГГ (например: 08.09.1990).",
-                    )
-                else:
-                    user.birth_date = datetime.strptime(text, "%d.%m.%Y").date().isoformat()
-                    self.show_main_menu(chat_id, user)
-                    session.state = "main_menu"
-
-            case "main_menu":
-                self.route_main_menu(session, user, chat_id, text)
-
-            case "taro_menu":
-                self.route_taro_menu(session, user, chat_id, text)
-
-            case "taro_ask_question":
-                self.handle_taro_question(session, user, chat_id, text)
+    def handle_consent(self, session: TgSession, user: User, chat_id: int, text: str) -> None:
+        if self.is_positive(text):
+            self.send_message(
+                chat_id,
+                "Спасибо ❤️\nПожалуйста, укажи своё имя (Напиши имя, чтобы я могла к тебе обращаться):",
+            )
+            session.state = "ask_name"
+        else:
+            self.send_message(
+                chat_id,
+                "Нажми «Старт», когда будешь готова начать.",
+                [["Старт"]],
+            )
 
-            case "tarot_mode_topic":
-                self.handle_tarot_mode_topic(session, user, chat_id, text)
+    def handle_name(self, session: TgSession, user: User, chat_id: int, text: str) -> None:
+        if not text:
+            self.send_message(chat_id, "Пожалуйста, напиши имя (например: Анна).")
+        else:
+            user.name = text[:100]
+            self.send_message(
+                chat_id,
+                f"Приятно познакомиться, {user.name}! Теперь, пожалуйста, введи дату рождения в формате ДД.MM.ГГГГ",
+            )
+            session.state = "ask_birth_date"
 
-            case "tarot_mode_timeframe":
-                self.handle_tarot_mode_timeframe(session, user, chat_id, text)
+    def handle_birth_date(self, session: TgSession, user: User, chat_id: int, text: str) -> None:
+        if not self.validate_date(text):
+            self.send_message(
+                chat_id,
+                "Неверный формат даты. Введите, пожалуйста, в формате ДД.MM.ГГГГ (например: 08.09.1990).",
+            )
+        else:
+            user.birth_date = self._parse_date_input(text).isoformat()
+            self.show_main_menu(chat_id, user)
+            session.state = "main_menu"
 
-            case "tarot_mode_cards":
-                self.handle_tarot_mode_cards(session, user, chat_id, text)
+    def handle_numerology_surname(self, session: TgSession, user: User, chat_id: int, text: str) -> None:
+        if not text:
+            self.send_message(chat_id, "Пожалуйста, напиши фамилию.")
+        else:
+            surname = self._normalize_name(text)
+            if self._is_system_command(surname):
+                self.show_main_menu(chat_id, user)
+                session.state = "main_menu"
+            elif not self._validate_surname(surname):
+                self.send_message(
+                    chat_id,
+                    "Пожалуйста, напиши фамилию только буквами (без эмодзи и команд).",
+                )
+            else:
+                user.surname = surname[:100]
+                self.render_numerology_menu(chat_id, user)
+                session.state = "numerology_menu"
 
-            case "tarot_mode_done":
-                self.handle_tarot_mode_done(session, user, chat_id, text)
+    def handle_horoscope_surname(self, session: TgSession, user: User, chat_id: int, text: str) -> None:
+        if not text:
+            self.send_message(chat_id, "Пожалуйста, напиши фамилию.")
+        else:
+            surname = self._normalize_name(text)
+            if self._is_system_command(surname):
+                self.show_main_menu(chat_id, user)
+                session.state = "main_menu"
+            elif not self._validate_surname(surname):
+                self.send_message(
+                    chat_id,
+                    "Пожалуйста, напиши фамилию только буквами (без эмодзи и команд).",
+                )
+            else:
+                user.surname = surname[:100]
 
-            case "numerology_ask_surname":
-                if not text:
-                    self.send_message(chat_id, "Пожалуйста, напиши фамилию.")
-                else:
-                    surname = self._normalize_name(text)
-                    if self._is_system_command(surname):
-                        self.show_main_menu(chat_id, user)
-                        session.state = "main_menu"
-                    elif not self._validate_surname(surname):
-                        self.send_message(
-                            chat_id,
-                            "Пожалуйста, напиши фамилию только буквами (без эмодзи и команд).",
-                        )
-                    else:
-                        user.surname = surname[:100]
-                        self.render_numerology_menu(chat_id, user)
-                        session.state = "numerology_menu"
-
-            case "numerology_menu":
-                self.route_numerology_menu(session, user, chat_id, text)
-
-            case "horoscope_ask_surname":
-                if not text:
-                    self.send_message(chat_id, "Пожалуйста, напиши фамилию.")
-                else:
-                    surname = self._normalize_name(text)
-                    if self._is_system_command(surname):
-                        self.show_main_menu(chat_id, user)
-                        session.state = "main_menu"
-                    elif not self._validate_surname(surname):
-                        self.send_message(
-                            chat_id,
-                            "Пожалуйста, напиши фамилию только буквами (без эмодзи и команд).",
-                        )
-                    else:
-                        user.surname = surname[:100]
-
-                        if not user.birth_time:
-                            self.send_message(
-                                chat_id,
-                                "Укажи время рождения в формате ЧЧ:ММ. Если не знаешь, нажми «Не знаю».",
-                                [["Не знаю"]],
-                            )
-                            session.state = "horoscope_ask_birth_time"
-                        else:
-                            self.show_horoscope_menu(chat_id, user)
-                            session.state = "horoscope_menu"
-
-            case "horoscope_ask_birth_time":
-                if text == "Не знаю":
-                    user.birth_time = None
-                    self.show_horoscope_menu(chat_id, user)
-                    session.state = "horoscope_menu"
-                elif not self.validate_time(text):
+                if not user.birth_time:
                     self.send_message(
                         chat_id,
-                        "Пожалуйста, введи время в формате ЧЧ:ММ (например: 08:30) или нажми «Не знаю».",
+                        "Укажи время рождения в формате ЧЧ:ММ. Если не знаешь, нажми «Не знаю».",
                         [["Не знаю"]],
                     )
+                    session.state = "horoscope_ask_birth_time"
                 else:
-                    user.birth_time = f"{text}:00"
                     self.show_horoscope_menu(chat_id, user)
                     session.state = "horoscope_menu"
 
-            case "horoscope_menu":
-                self.route_horoscope_menu(session, user, chat_id, text)
-
-            case "podruzhka_free":
-                self.handle_podruzhka_free(session, user, chat_id, text)
-
-            case "podruzhka_chat":
-                self.handle_podruzhka_chat(session, user, chat_id, text)
-
-            case "subscription_menu":
-                self.route_subscription_menu(session, user, chat_id, text)
-
-            case "await_payment":
-                self.handle_payment_status(session, user, chat_id, text)
-
-            case "support_ask":
-                if text == "Назад в меню":
-                    self.show_main_menu(chat_id, user)
-                    session.state = "main_menu"
-                elif not text:
-                    self.send_message(chat_id, "Опиши проблему одним сообщением.")
-                else:
-                    self.storage.log_chat_message(
-                        chat_id,
-                        "system",
-                        f"SUPPORT_REQUEST: {text}",
-                        meta={"source": "support_request"},
-                    )
-                    self.send_message(
-                        chat_id,
-                        "Спасибо! Я передала сообщение администратору. Мы ответим как можно скорее.",
-                        [["Назад в меню"]],
-                    )
-                    session.state = "main_menu"
+    def handle_horoscope_birth_time(self, session: TgSession, user: User, chat_id: int, text: str) -> None:
+        if text == "Не знаю":
+            user.birth_time = None
+            self.show_horoscope_menu(chat_id, user)
+            session.state = "horoscope_menu"
+        elif not self.validate_time(text):
+            self.send_message(
+                chat_id,
+                "Пожалуйста, введи время в формате ЧЧ:ММ (например: 08:30) или нажми «Не знаю».",
+                [["Не знаю"]],
+            )
+        else:
+            user.birth_time = f"{text}:00"
+            self.show_horoscope_menu(chat_id, user)
+            session.state = "horoscope_menu"
 
-            case _:
-                self.show_main_menu(chat_id, user)
-                session.state = "main_menu"
+    def handle_support_request(self, session: TgSession, user: User, chat_id: int, text: str) -> None:
+        if text == "Назад в меню":
+            self.show_main_menu(chat_id, user)
+            session.state = "main_menu"
+        elif not text:
+            self.send_message(chat_id, "Опиши проблему одним сообщением.")
+        else:
+            self.storage.log_chat_message(
+                chat_id,
+                "system",
+                f"SUPPORT_REQUEST: {text}",
+                meta={"source": "support_request"},
+            )
+            self.send_message(
+                chat_id,
+                "Спасибо! Я передала сообщение администратору. Мы ответим как можно скорее.",
+                [["Назад в меню"]],
+            )
+            session.state = "main_menu"
 
-        self.storage.save_user(user)
-        self.storage.save_session(session)
+    def handle_unknown_state(self, session: TgSession, user: User, chat_id: int, text: str) -> None:
+        self.show_main_menu(chat_id, user)
+        session.state = "main_menu"
 
     def show_welcome(self, chat_id: int) -> None:
         text = (
@@ -273,18 +342,19 @@ class ChatService:
         self.send_message(chat_id, text, [["Старт"]])
 
     def show_main_menu(self, chat_id: int, user: User) -> None:
+        self.send_message(chat_id, self._main_menu_text(user), self._main_menu_keyboard)
+
+    def _notify_and_show_main_menu(self, chat_id: int, user: User, notice: str) -> None:
+        # One message instead of the notice followed by a separate menu message.
+        self.send_message(chat_id, f"{notice}\n\n{self._main_menu_text(user)}", self._main_menu_keyboard)
+
+    @staticmethod
+    def _main_menu_text(user: User) -> str:
         name = user.name if user.name else "Подруга"
-        text = (
+        return (
             f"{name}, теперь давай выберем, с чего начнём 💫\n"
             "Я рядом, чтобы помочь — просто выбери раздел, который тебе сейчас ближе."
         )
-        keyboard = [
-            ["🃏 Расклад Таро", "🃏 Режим таролога"],
-            ["🔢 Нумерология", "♒ Гороскоп"],
-            ["💬 Подружка", "💎 Подписка"],
-            ["ℹ️ Помощь"],
-        ]
-        self.send_message(chat_id, text, keyboard)
 
     def route_main_menu(self, session: TgSession, user: User, chat_id: int, text: str) -> None:
         match text:
@@ -343,6 +413,10 @@ class ChatService:
                 session.state = "podruzhka_chat" if user.subscription == "paid" else "podruzhka_free"
 
             case "💎 Подписка" | "Получить доступ":
+                if self.payments is None:
+                    self._notify_and_show_main_menu(chat_id, user, self.PAYMENTS_UNAVAILABLE_TEXT)
+                    session.state = "main_menu"
+                    return
                 self.show_subscription_menu(chat_id)
                 session.state = "subscription_menu"
 
@@ -371,7 +445,6 @@ class ChatService:
             session.state = "main_menu"
             return
 
-        session.data = session.data or {}
         session.data["taro_type"] = text
 
         suggest = (
@@ -415,7 +488,7 @@ class ChatService:
                 return
 
         if user.subscription == "paid":
-            today = datetime.now().strftime("%Y-%m-%d")
+            today = self._today_str()
             paid_used_today = self.storage.count_taro_readings_for_date(
                 chat_id=user.chat_id,
                 cards_count=3,
@@ -434,20 +507,25 @@ class ChatService:
         type_value = session.data.get("taro_type", "Расклад")
         prompt = self.build_taro_prompt(user.name or "Подруга", type_value, text, cards)
 
-        self.send_message(
+        preview_id = self.send_message(
             chat_id,
             "Сейчас я посоветуюсь с картами и соберу расклад — это займёт пару секунд ✨",
         )
 
-        ai_response = self.ask_ai(prompt)
+        ai_response = self.ask_ai_streaming(
+            prompt,
+            self.TARO_SYSTEM_PROMPT,
+            chat_id=chat_id,
+            preview_id=preview_id,
+            max_chars=4000,
+        )
         ai_meta = self._ai_meta(ai_response)
         if not ai_response:
             result = "К сожалению, сейчас я не могу подготовить расклад. Но не переживай — мы вернёмся к этому чуть позже."
         else:
             result = ai_response.content
 
-        if len(result) > 4000:
-            result = result[:4000] + "..."
+        result = self._truncate_reply(result, 4000)
 
         final = (
             f"Спасибо, {user.name}, что поделилась своим вопросом 🌸\n\n"
@@ -467,7 +545,7 @@ class ChatService:
             cards_count=cards,
             result=result,
             meta={
-                "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "generated_at": self._now_str(),
                 "prompt": self.shorten(prompt, 800),
                 **ai_meta,
             },
@@ -482,6 +560,10 @@ class ChatService:
             self.schedule_retention(user)
             session.state = "main_menu"
 
+        # The streamed preview is superseded by the formatted reply.
+        if preview_id is not None:
+            self.tg.delete_message(chat_id, preview_id)
+
     def start_tarot_mode(self, session: TgSession, user: User, chat_id: int) -> None:
         if not self._check_tarot_mode_limit(session, user, chat_id):
             return
@@ -507,7 +589,6 @@ class ChatService:
             session.state = "tarot_mode_topic"
             return
 
-        session.data = session.data or {}
         session.data["tarot_mode_topic"] = text.strip()
         self.send_message(
             chat_id,
@@ -523,7 +604,6 @@ class ChatService:
             session.state = "main_menu"
             return
 
-        session.data = session.data or {}
         session.data["tarot_mode_timeframe"] = text.strip()
 
         topic = session.data.get("tarot_mode_topic", "")
@@ -616,9 +696,8 @@ class ChatService:
         ai_response = self.ask_ai(prompt, system)
         ai_meta = self._ai_meta(ai_response)
         if not ai_response:
-            self.send_message(chat_id, "Сейчас не могу расшифровать расклад. Попробуй чуть позже.")
             self._reset_tarot_mode_session(session)
-            self.show_main_menu(chat_id, user)
+            self._notify_and_show_main_menu(chat_id, user, "Сейчас не могу расшифровать расклад. Попробуй чуть позже.")
             session.state = "main_menu"
             return
 
@@ -629,7 +708,7 @@ class ChatService:
             spread=spread_text,
             cards=cards_text,
             meta={
-                "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "generated_at": self._now_str(),
                 "prompt": self.shorten(prompt, 800),
                 **ai_meta,
             },
@@ -720,8 +799,7 @@ class ChatService:
             return
 
         reply = ai_response.content
-        if len(reply) > 300:
-            reply = reply[:300] + "..."
+        reply = self._truncate_reply(reply, 300)
 
         final = (
             reply
@@ -736,7 +814,7 @@ class ChatService:
             [["Получить доступ", "Назад в меню"]],
             meta=self._podruzhka_meta(ai_meta),
         )
-        user.podruzhka_free_used_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        user.podruzhka_free_used_at = self._now_str()
         self.schedule_retention(user)
         session.state = "main_menu"
 
@@ -758,7 +836,7 @@ class ChatService:
             )
             return
 
-        today = datetime.now().strftime("%Y-%m-%d")
+        today = self._today_str()
         used_today = self.storage.count_podruzhka_replies_for_date(
             chat_id=user.chat_id,
             date_value=today,
@@ -786,8 +864,7 @@ class ChatService:
             return
 
         reply = ai_response.content
-        if len(reply) > self.PODRUZHKA_MAX_REPLY_CHARS:
-            reply = reply[: self.PODRUZHKA_MAX_REPLY_CHARS] + "..."
+        reply = self._truncate_reply(reply, self.PODRUZHKA_MAX_REPLY_CHARS)
 
         self.send_message(
             chat_id,
@@ -809,7 +886,7 @@ class ChatService:
                 session.state = "main_menu"
                 return
         else:
-            today = datetime.now().strftime("%Y-%m-%d")
+            today = self._today_str()
             paid_used_today = self.storage.count_numerology_readings_for_date(
                 chat_id=user.chat_id,
                 date_value=today,
@@ -833,8 +910,7 @@ class ChatService:
         else:
             result = ai_response.content
 
-        if len(result) > 4000:
-            result = result[:4000] + "..."
+        result = self._truncate_reply(result, 4000)
 
         final = (
             result
@@ -854,7 +930,7 @@ class ChatService:
             type_value="money_code",
             result=result,
             meta={
-                "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "generated_at": self._now_str(),
                 "prompt": self.shorten(prompt, 800),
                 **ai_meta,
             },
@@ -871,7 +947,7 @@ class ChatService:
             session.state = "numerology_menu"
             return
 
-        today = datetime.now().strftime("%Y-%m-%d")
+        today = self._today_str()
         paid_used_today = self.storage.count_numerology_readings_for_date(
             chat_id=user.chat_id,
             date_value=today,
@@ -885,11 +961,7 @@ class ChatService:
             session.state = "numerology_menu"
             return
 
-        birth = (
-            datetime.strptime(user.birth_date, "%Y-%m-%d").strftime("%d.%m.%Y")
-            if user.birth_date
-            else ""
-        )
+        birth = self._format_birth_date(user.birth_date)
         prompt = self.build_numerology_prompt(user.name or "", user.surname or "", birth)
         self.send_message(
             chat_id,
@@ -903,8 +975,7 @@ class ChatService:
         else:
             result = ai_response.content
 
-        if len(result) > 4000:
-            result = result[:4000] + "..."
+        result = self._truncate_reply(result, 4000)
 
         self.send_message(chat_id, result, [["Назад в меню"]], meta=ai_meta)
 
@@ -916,7 +987,7 @@ class ChatService:
             type_value="full",
             result=result,
             meta={
-                "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "generated_at": self._now_str(),
                 "prompt": self.shorten(prompt, 800),
                 **ai_meta,
             },
@@ -936,7 +1007,7 @@ class ChatService:
                 session.state = "main_menu"
                 return
         else:
-            today = datetime.now().strftime("%Y-%m-%d")
+            today = self._today_str()
             paid_used_today = self.storage.count_horoscope_readings_for_date(
                 chat_id=user.chat_id,
                 date_value=today,
@@ -953,7 +1024,7 @@ class ChatService:
         sign = self.get_zodiac_sign(user.birth_date)
         prompt = self.build_horoscope_free_prompt(sign)
         self.send_message(chat_id, "Смотрю твою астрологическую волну, подожди пару секунд ✨")
-        ai_response = self.ask_ai(prompt)
+        ai_response = self._ask_daily_horoscope(sign, prompt)
         ai_meta = self._ai_meta(ai_response)
 
         if not ai_response:
@@ -961,8 +1032,7 @@ class ChatService:
         else:
             result = ai_response.content
 
-        if len(result) > 4000:
-            result = result[:4000] + "..."
+        result = self._truncate_reply(result, 4000)
 
         final = (
             f"Твой знак — {sign}.\n"
@@ -985,7 +1055,7 @@ class ChatService:
             type_value="daily",
             result=result,
             meta={
-                "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "generated_at": self._now_str(),
                 "prompt": self.shorten(prompt, 800),
                 **ai_meta,
             },
@@ -1003,7 +1073,7 @@ class ChatService:
             session.state = "horoscope_menu"
             return
 
-        today = datetime.now().strftime("%Y-%m-%d")
+        today = self._today_str()
         paid_used_today = self.storage.count_horoscope_readings_for_date(
             chat_id=user.chat_id,
             date_value=today,
@@ -1017,16 +1087,8 @@ class ChatService:
             session.state = "horoscope_menu"
             return
 
-        birth = (
-            datetime.strptime(user.birth_date, "%Y-%m-%d").strftime("%d.%m.%Y")
-            if user.birth_date
-            else ""
-        )
-        time_value = (
-            datetime.strptime(user.birth_time, "%H:%M:%S").strftime("%H:%M")
-            if user.birth_time
-            else "неизвестно"
-        )
+        birth = self._format_birth_date(user.birth_date)
+        time_value = self._format_birth_time(user.birth_time) if user.birth_time else "неизвестно"
         prompt = self.build_horoscope_prompt(user.name or "", user.surname or "", birth, time_value)
         self.send_message(
             chat_id,
@@ -1040,8 +1102,7 @@ class ChatService:
         else:
             result = ai_response.content
 
-        if len(result) > 4000:
-            result = result[:4000] + "..."
+        result = self._truncate_reply(result, 4000)
 
         self.send_message(chat_id, result, [["Назад в меню"]], meta=ai_meta)
 
@@ -1055,7 +1116,7 @@ class ChatService:
             type_value="full",
             result=result,
             meta={
-                "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "generated_at": self._now_str(),
                 "prompt": self.shorten(prompt, 800),
                 **ai_meta,
             },
@@ -1064,20 +1125,45 @@ class ChatService:
         session.state = "horoscope_menu"
 
     def is_positive(self, text: str) -> bool:
-        t = text.lower()
-        return t in {"старт", "да", "ok", "okey", "начать", "start", "давай", "готово"}
+        return text.casefold() in self._POSITIVE_ANSWERS
 
     def validate_date(self, text: str) -> bool:
-        if not re.fullmatch(r"\d{2}\.\d{2}\.\d{4}", text):
+        if not self._DATE_RE.fullmatch(text):
             return False
         try:
-            datetime.strptime(text, "%d.%m.%Y")
+            self._parse_date_input(text)
             return True
         except ValueError:
             return False
 
+    @staticmethod
+    def _parse_date_input(text: str) -> date:
+        # DD.MM.YYYY, already checked against _DATE_RE; date() still rejects impossible days.
+        return date(int(text[6:10]), int(text[3:5]), int(text[:2]))
+
+    @staticmethod
+    def _format_birth_date(birth_date: str | None) -> str:
+        # Stored as YYYY-MM-DD, shown as DD.MM.YYYY; an unparseable admin edit is shown as is.
+        if not birth_date:
+            return ""
+        try:
+            year, month, day = _split_birth_date(birth_date)
+        except ValueError:
+            return birth_date
+        return f"{day:02d}.{month:02d}.{year:04d}"
+
+    @staticmethod
+    def _format_birth_time(birth_time: str) -> str:
+        # Stored as HH:MM:SS, shown as HH:MM; admin edits that do not match are parsed or shown as is.
+        if len(birth_time) == 8 and birth_time[2] == birth_time[5] == ":":
+            return birth_time[:5]
+        try:
+            return datetime.strptime(birth_time, "%H:%M:%S").strftime("%H:%M")
+        except ValueError:
+            return birth_time
+
     def validate_time(self, text: str) -> bool:
-        if not re.fullmatch(r"\d{2}:\d{2}", text):
+        if not self._TIME_RE.fullmatch(text):
             return False
         h, m = text.split(":")
         return 0 <= int(h) < 24 and 0 <= int(m) < 60
@@ -1091,18 +1177,10 @@ class ChatService:
         )
 
     def is_distress_message(self, text: str) -> bool:
-        t = text.lower()
-        for word in ["суиц", "самоуб", "убью", "смерть", "умереть"]:
-            if word in t:
-                return True
-        return False
+        return self._DISTRESS_RE.search(text.lower()) is not None
 
     def build_money_code_prompt(self, name: str, birth_date: str | None) -> str:
-        birth = (
-            datetime.strptime(birth_date, "%Y-%m-%d").strftime("%d.%m.%Y")
-            if birth_date
-            else ""
-        )
+        birth = self._format_birth_date(birth_date)
         return (
             f"На основе имени {name} и даты рождения {birth} вычисли денежный (финансовый) код. "
             "Верни одну цифру и краткое пояснение (1-2 предложения). Отвечай по-русски."
@@ -1136,43 +1214,17 @@ class ChatService:
     def get_zodiac_sign(self, birth_date: str | None) -> str:
         if not birth_date:
             return ""
-        date_value = datetime.strptime(birth_date, "%Y-%m-%d")
-        day = date_value.day
-        month = date_value.month
-
-        if (month == 3 and day >= 21) or (month == 4 and day <= 19):
-            return "Овен"
-        if (month == 4 and day >= 20) or (month == 5 and day <= 20):
-            return "Телец"
-        if (month == 5 and day >= 21) or (month == 6 and day <= 20):
-            return "Близнецы"
-        if (month == 6 and day >= 21) or (month == 7 and day <= 22):
-            return "Рак"
-        if (month == 7 and day >= 23) or (month == 8 and day <= 22):
-            return "Лев"
-        if (month == 8 and day >= 23) or (month == 9 and day <= 22):
-            return "Дева"
-        if (month == 9 and day >= 23) or (month == 10 and day <= 22):
-            return "Весы"
-        if (month == 10 and day >= 23) or (month == 11 and day <= 21):
-            return "Скорпион"
-        if (month == 11 and day >= 22) or (month == 12 and day <= 21):
-            return "Стрелец"
-        if (month == 12 and day >= 22) or (month == 1 and day <= 19):
-            return "Козерог"
-        if (month == 1 and day >= 20) or (month == 2 and day <= 18):
-            return "Водолей"
-        return "Рыбы"
+        try:
+            _, month, day = _split_birth_date(birth_date)
+        except ValueError:
+            return ""
+        return _ZODIAC_BY_DAY[month * 32 + day]
 
     def build_taro_prompt(self, name: str, type_value: str, question: str, cards: int) -> str:
-        system = "Ты — нежный и заботливый таролог, говоришь мягко и поддерживающе. Отвечай по-русски."
-        instruction = (
-            f"Для пользователя {name} сделай расклад \"{type_value}\" на {cards} карт(ы). "
-            "Дай название каждой карты (если возможно), краткую интерпретацию до 400 символов для каждой карты и общий вывод по раскладу (до 400 символов). "
-            "Стиль: мягкий, поддерживающий, без категоричных предсказаний. В конце предложи 2-3 уточняющих вопроса, которые пользователь может задать для более точного ответа. "
+        return (
+            f"Для пользователя {name} сделай расклад \"{type_value}\" на {cards} карт(ы).\n"
             f"Вопрос пользователя: «{question}»."
         )
-        return f"{system}\n\n{instruction}"
 
     def build_tarot_mode_spread_prompt(self, topic: str, timeframe: str) -> str:
         return (
@@ -1332,7 +1384,7 @@ class ChatService:
         return cards or None
 
     def _check_tarot_mode_limit(self, session: TgSession, user: User, chat_id: int) -> bool:
-        today = datetime.now().strftime("%Y-%m-%d")
+        today = self._today_str()
         used_today = self.storage.count_tarot_mode_for_date(user.chat_id, today)
         limit = self.TAROT_MODE_PAID_DAILY_LIMIT if user.subscription == "paid" else self.TAROT_MODE_FREE_DAILY_LIMIT
         if used_today < limit:
@@ -1350,13 +1402,22 @@ class ChatService:
 
     @staticmethod
     def _reset_tarot_mode_session(session: TgSession) -> None:
-        session.data = session.data or {}
         keys = [key for key in session.data.keys() if key.startswith("tarot_mode_")]
         for key in keys:
             session.data.pop(key, None)
 
+    @staticmethod
+    def _truncate_reply(text: str, limit: int) -> str:
+        if len(text) <= limit:
+            return text
+        # Prefer ending on a whole sentence unless that would drop more than half of the allowed text.
+        cut = max(text.rfind(mark, 0, limit) for mark in ".!?…")
+        if cut >= limit // 2:
+            return text[: cut + 1]
+        return text[:limit] + "..."
+
     def shorten(self, text: str, limit: int = 200) -> str:
-        return text if len(text) <= limit else f"{text[:limit]}..."
+        return text if len(text) <= limit else text[:limit] + "..."
 
     @staticmethod
     def _normalize_name(text: str) -> str:
@@ -1406,26 +1467,25 @@ class ChatService:
             f"• 12 месяцев — {self._format_rub(amounts[12])} (-10%)\n\n"
             f"{self._subscription_benefits_text()}"
         )
-        keyboard = [["1 месяц", "6 месяцев (-10%)"], ["12 месяцев (-10%)", "Назад в меню"]]
-        self.send_message(chat_id, text, keyboard)
+        self.send_message(chat_id, text, self._SUBSCRIPTION_KEYBOARD)
 
     def route_subscription_menu(self, session: TgSession, user: User, chat_id: int, text: str) -> None:
-        amounts = self._subscription_amounts()
-        match text:
-            case "1 месяц":
-                self._start_payment(session, chat_id, months=1, amount_rub=amounts[1])
-            case "6 месяцев (-10%)":
-                self._start_payment(session, chat_id, months=6, amount_rub=amounts[6])
-            case "12 месяцев (-10%)":
-                self._start_payment(session, chat_id, months=12, amount_rub=amounts[12])
-            case "Назад в меню":
-                self.show_main_menu(chat_id, user)
-                session.state = "main_menu"
-            case _:
-                self.show_subscription_menu(chat_id)
-                session.state = "subscription_menu"
+        months = self._SUBSCRIPTION_PLANS.get(text)
+        if months is not None:
+            self._start_payment(session, chat_id, months=months, amount_rub=self._subscription_amounts()[months])
+        elif text == "Назад в меню":
+            self.show_main_menu(chat_id, user)
+            session.state = "main_menu"
+        else:
+            self.show_subscription_menu(chat_id)
+            session.state = "subscription_menu"
 
     def _start_payment(self, session: TgSession, chat_id: int, *, months: int, amount_rub: int) -> None:
+        if self.payments is None:
+            self.send_message(chat_id, self.PAYMENTS_UNAVAILABLE_TEXT, [["Назад в меню"]])
+            session.state = "main_menu"
+            return
+
         description = f"Подписка на {months} мес."
         metadata = {"chat_id": chat_id, "months": months}
         try:
@@ -1452,7 +1512,6 @@ class ChatService:
             confirmation_url=created.confirmation_url,
         )
         self._schedule_payment_checks(chat_id, created.payment_id)
-        session.data = session.data or {}
         session.data["payment_id"] = created.payment_id
         session.data["payment_months"] = months
 
@@ -1482,7 +1541,7 @@ class ChatService:
             self.route_subscription_menu(session, user, chat_id, text)
             return
 
-        payment_id = (session.data or {}).get("payment_id")
+        payment_id = session.data.get("payment_id")
         if not payment_id:
             last_payment = self.storage.get_last_pending_payment(chat_id)
             payment_id = last_payment.yookassa_payment_id if last_payment else None
@@ -1508,6 +1567,7 @@ class ChatService:
     def handle_scheduled_payment_check(self, chat_id: int, payment_id: str) -> None:
         session = self.storage.get_or_create_session(chat_id)
         user = self.storage.get_or_create_user(chat_id)
+        snapshot = self._snapshot(session, user)
         self._process_payment_status(
             session=session,
             user=user,
@@ -1516,13 +1576,25 @@ class ChatService:
             notify_pending=False,
             notify_errors=False,
         )
-        self.storage.save_user(user)
-        self.storage.save_session(session)
+        self._save_changed(session, user, snapshot)
+
+    @staticmethod
+    def _snapshot(session: TgSession, user: User) -> tuple[User, str, dict[str, Any]]:
+        # session.data values are only ever reassigned, never mutated in place, so a shallow copy is enough.
+        return replace(user), session.state, dict(session.data)
+
+    def _save_changed(self, session: TgSession, user: User, snapshot: tuple[User, str, dict[str, Any]]) -> None:
+        # Most updates change one of the two rows or neither; untouched rows are not rewritten.
+        saved_user, saved_state, saved_data = snapshot
+        if user != saved_user:
+            self.storage.save_user(user)
+        if session.state != saved_state or session.data != saved_data:
+            self.storage.save_session(session)
 
     def _activate_subscription(self, user: User, months: int) -> None:
         now = datetime.now()
         user.subscription = "paid"
-        user.subscription_expires_at = self._add_months(now, months).strftime("%Y-%m-%d %H:%M:%S")
+        user.subscription_expires_at = self._add_months(now, months).isoformat(" ", "seconds")
 
     def _schedule_payment_checks(self, chat_id: int, payment_id: str) -> None:
         now = datetime.now()
@@ -1544,6 +1616,9 @@ class ChatService:
         if payment and payment.status == "succeeded":
             return
 
+        if self.payments is None:
+            return
+
         try:
             status = self.payments.get_payment_status(payment_id)
         except Exception:
@@ -1552,11 +1627,10 @@ class ChatService:
             return
 
         if status == "succeeded":
-            months = payment.months if payment else (session.data or {}).get("payment_months", 1)
+            months = payment.months if payment else session.data.get("payment_months", 1)
             self._activate_subscription(user, months)
             self.storage.update_payment_status(payment_id, status, self._now_str())
-            self.send_message(chat_id, f"Оплата прошла! Подписка активирована на {months} мес. 💎")
-            self.show_main_menu(chat_id, user)
+            self._notify_and_show_main_menu(chat_id, user, f"Оплата прошла! Подписка активирована на {months} мес. 💎")
             session.state = "main_menu"
             return
 
@@ -1581,7 +1655,12 @@ class ChatService:
 
     @staticmethod
     def _now_str() -> str:
-        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # Same text as strftime("%Y-%m-%d %H:%M:%S"), without going through the format parser.
+        return datetime.now().isoformat(" ", "seconds")
+
+    @staticmethod
+    def _today_str() -> str:
+        return date.today().isoformat()
 
     def schedule_retention(self, user: User) -> None:
         if user.subscription == "paid":
@@ -1601,6 +1680,48 @@ class ChatService:
             logging.warning("AI error: %s", exc)
             return None
 
+    def _ask_daily_horoscope(self, sign: str, prompt: str) -> AIResponse | None:
+        today = self._today_str()
+        with self._daily_horoscopes_lock:
+            cached = self._daily_horoscopes.get(sign)
+        if cached and cached[0] == today:
+            # Reused answers cost no tokens, so usage is not reported again.
+            return cached[1]._replace(usage=None)
+
+        ai_response = self.ask_ai(prompt)
+        if ai_response:
+            with self._daily_horoscopes_lock:
+                self._daily_horoscopes[sign] = (today, ai_response)
+        return ai_response
+
+    def ask_ai_streaming(
+        self,
+        prompt: str,
+        system: str | None = None,
+        *,
+        chat_id: int,
+        preview_id: int | None,
+        max_chars: int,
+    ) -> AIResponse | None:
+        # Shows the answer in the preview message as it is generated; the caller still sends the final reply.
+        if preview_id is None:
+            return self.ask_ai(prompt, system)
+
+        last_edit = time.monotonic()
+
+        def show_progress(text: str) -> None:
+            nonlocal last_edit
+            now = time.monotonic()
+            if now - last_edit >= self.AI_PREVIEW_EDIT_INTERVAL:
+                last_edit = now
+                self.tg.edit_message_text(chat_id, preview_id, text[:max_chars])
+
+        try:
+            return self.ai.get_answer_streaming(prompt, system, on_progress=show_progress, max_chars=max_chars)
+        except Exception as exc:
+            logging.warning("AI error: %s", exc)
+            return None
+
     @staticmethod
     def _ai_meta(response: AIResponse | None) -> dict[str, Any]:
         if not response:
@@ -1619,5 +1740,8 @@ class ChatService:
         month_index = value.month - 1 + months
         year = value.year + month_index // 12
         month = month_index % 12 + 1
-        day = min(value.day, calendar.monthrange(year, month)[1])
+        days_in_month = _DAYS_IN_MONTH[month - 1]
+        if month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+            days_in_month = 29
+        day = min(value.day, days_in_month)
         return value.replace(year=year, month=month, day=day)
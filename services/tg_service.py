@@ -1,10 +1,31 @@
 from __future__ import annotations
 
+from functools import lru_cache
 import json
 import logging
 from typing import Any
 
 import requests
+from requests.adapters import HTTPAdapter
+
+
+# Connect attempts fail fast; the read timeout is what long polling waits on.
+CONNECT_TIMEOUT = 3
+# Enough pooled keep-alive connections for the bot's and admin broadcast's worker threads.
+POOL_MAXSIZE = 16
+
+
+@lru_cache(maxsize=128)
+def _reply_keyboard_markup(keyboard: tuple[tuple[str, ...], ...]) -> str:
+    # Bot replies use a small fixed set of keyboards, so each is serialized once.
+    return json.dumps(
+        {
+            "keyboard": keyboard,
+            "resize_keyboard": True,
+            "one_time_keyboard": True,
+        },
+        ensure_ascii=False,
+    )
 
 
 class TgService:
@@ -12,8 +33,11 @@ class TgService:
         self._token = token
         self._timeout = timeout
         self._base_url = f"https://api.telegram.org/bot{self._token}"
+        # Keep-alive pool shared by every call, so broadcasts reuse one TLS connection per thread.
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE))
 
-    def send_message(self, chat_id: int, text: str, keyboard: list[list[str]] | None = None) -> None:
+    def send_message(self, chat_id: int, text: str, keyboard: list[list[str]] | None = None) -> int | None:
         data: dict[str, Any] = {
             "chat_id": chat_id,
             "text": text,
@@ -22,16 +46,25 @@ class TgService:
         }
 
         if keyboard:
-            data["reply_markup"] = json.dumps(
-                {
-                    "keyboard": keyboard,
-                    "resize_keyboard": True,
-                    "one_time_keyboard": True,
-                },
-                ensure_ascii=False,
-            )
+            data["reply_markup"] = _reply_keyboard_markup(tuple(map(tuple, keyboard)))
+
+        result = self._post("sendMessage", data)
+        return result.get("message_id") if isinstance(result, dict) else None
+
+    def edit_message_text(self, chat_id: int, message_id: int, text: str) -> None:
+        # Plain text: partial output may cut an HTML tag in half.
+        self._post(
+            "editMessageText",
+            {
+                "chat_id": chat_id,
+                "message_id": message_id,
+                "text": text,
+                "disable_web_page_preview": True,
+            },
+        )
 
-        self._post("sendMessage", data)
+    def delete_message(self, chat_id: int, message_id: int) -> None:
+        self._post("deleteMessage", {"chat_id": chat_id, "message_id": message_id})
 
     def send_inline_keyboard(self, chat_id: int, text: str, buttons: list[list[dict[str, str]]]) -> None:
         inline = {"inline_keyboard": buttons}
@@ -52,10 +85,10 @@ class TgService:
             params["offset"] = offset
 
         try:
-            response = requests.get(
+            response = self._session.get(
                 f"{self._base_url}/getUpdates",
                 params=params,
-                timeout=timeout + 5,
+                timeout=(CONNECT_TIMEOUT, timeout + 5),
             )
             response.raise_for_status()
             data = response.json()
@@ -67,12 +100,18 @@ class TgService:
             logging.error("Telegram API error: %s", exc)
             return []
 
-    def _post(self, method: str, data: dict[str, Any]) -> None:
+    def _post(self, method: str, data: dict[str, Any]) -> Any:
         try:
-            requests.post(
+            response = self._session.post(
                 f"{self._base_url}/{method}",
                 data=data,
-                timeout=self._timeout,
+                timeout=(CONNECT_TIMEOUT, self._timeout),
             )
+            payload = response.json()
         except Exception as exc:
             logging.error("Telegram API error: %s", exc, extra={"data": data})
+            return None
+        if not payload.get("ok"):
+            logging.warning("Telegram API error: %s", payload.get("description"))
+            return None
+        return payload.get("result")
@@ -46,6 +46,7 @@ class Settings:
     db_path: str
     polling_timeout: int
     polling_sleep: float
+    update_workers: int
     offset_file: str | None
     log_level: str
     yookassa_shop_id: str
@@ -66,11 +67,10 @@ def load_settings() -> Settings:
         raise ValueError("TELEGRAM_BOT_TOKEN is required")
     if not openai_api_key:
         raise ValueError("OPENAI_API_KEY is required")
-    if not yookassa_shop_id:
-        raise ValueError("YOOKASSA_SHOP_ID is required")
-    if not yookassa_secret_key:
+    # Payments are optional: without YOOKASSA_SHOP_ID the bot runs with subscriptions disabled.
+    if yookassa_shop_id and not yookassa_secret_key:
         raise ValueError("YOOKASSA_SECRET_KEY is required")
-    if not yookassa_return_url:
+    if yookassa_shop_id and not yookassa_return_url:
         raise ValueError("YOOKASSA_RETURN_URL is required")
 
     return Settings(
@@ -85,6 +85,7 @@ def load_settings() -> Settings:
         db_path=_env("DATABASE_PATH", os.path.join("data", "taro.db")),
         polling_timeout=_env_int("POLLING_TIMEOUT", 30),
         polling_sleep=_env_float("POLLING_SLEEP", 1.0),
+        update_workers=_env_int("BOT_UPDATE_WORKERS", 8),
         offset_file=_env("BOT_OFFSET_FILE"),
         log_level=_env("LOG_LEVEL", "INFO"),
         yookassa_shop_id=yookassa_shop_id,
@@ -1,11 +1,35 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
+import html
 import json
 import sqlite3
 import threading
-from typing import Any, Iterable
+from typing import Any, Iterable, Iterator
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib codec
+    orjson = None
+
+
+# Every distinct SQL string used below stays prepared on the connection.
+STATEMENT_CACHE_SIZE = 256
+
+# content_html is the escaped content, computed once so admin pages can output it as-is.
+_INSERT_CHAT_MESSAGE_SQL = """
+    INSERT INTO chat_messages (chat_id, role, content, content_html, meta, created_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+_CHAT_MESSAGES_SQL = """
+    SELECT *
+    FROM chat_messages
+    WHERE chat_id = ?
+    ORDER BY datetime(created_at) ASC, id ASC
+    LIMIT ?
+"""
 
 
 @dataclass
@@ -25,7 +49,7 @@ class User:
 class TgSession:
     chat_id: int
     state: str
-    data: dict[str, Any]
+    data: dict[str, Any] = field(default_factory=dict)
 
 
 @dataclass
@@ -34,6 +58,8 @@ class Reminder:
     chat_id: int
     message: str
     send_at: str
+    user_subscription: str | None = None
+    user_retention_sent_at: str | None = None
 
 
 @dataclass
@@ -53,8 +79,15 @@ class Storage:
     def __init__(self, db_path: str) -> None:
         self._db_path = db_path
         self._lock = threading.Lock()
-        self._conn = sqlite3.connect(self._db_path, check_same_thread=False)
+        self._conn = sqlite3.connect(
+            self._db_path,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
         self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA cache_size=-65536")
         self._init_schema()
 
     def _init_schema(self) -> None:
@@ -82,6 +115,7 @@ class Storage:
             chat_id INTEGER NOT NULL,
             role TEXT NOT NULL,
             content TEXT NOT NULL,
+            content_html TEXT,
             meta TEXT,
             created_at TEXT NOT NULL
         );
@@ -166,11 +200,34 @@ class Storage:
 
         CREATE INDEX IF NOT EXISTS idx_payments_chat_id_created_at
             ON payments (chat_id, created_at, id);
+
+        -- Keyed on datetime(...) like the queries, so values typed in the admin form in any format
+        -- SQLite understands ("T" separator, date only) are ordered as timestamps.
+        DROP INDEX IF EXISTS idx_payments_status_paid_at;
+        CREATE INDEX IF NOT EXISTS idx_payments_status_paid_at_dt
+            ON payments (status, datetime(paid_at));
+
+        DROP INDEX IF EXISTS idx_users_subscription_expires_at;
+        CREATE INDEX IF NOT EXISTS idx_users_subscription_expires_at_dt
+            ON users (subscription, datetime(subscription_expires_at));
+
+        CREATE INDEX IF NOT EXISTS idx_taro_readings_chat_id_cards_count
+            ON taro_readings (chat_id, cards_count, created_at);
+
+        CREATE INDEX IF NOT EXISTS idx_tarot_mode_logs_chat_id_created_at
+            ON tarot_mode_logs (chat_id, created_at);
+
+        CREATE INDEX IF NOT EXISTS idx_numerology_readings_chat_id_type
+            ON numerology_readings (chat_id, type, created_at);
+
+        CREATE INDEX IF NOT EXISTS idx_horoscope_readings_chat_id_type
+            ON horoscope_readings (chat_id, type, created_at);
         """
         with self._lock:
             self._conn.executescript(schema)
             self._conn.commit()
         self._ensure_user_columns()
+        self._ensure_chat_message_columns()
         self._ensure_default_settings()
 
     def _ensure_user_columns(self) -> None:
@@ -178,6 +235,11 @@ class Storage:
         if "retention_message_sent_at" not in columns:
             self._execute("ALTER TABLE users ADD COLUMN retention_message_sent_at TEXT")
 
+    def _ensure_chat_message_columns(self) -> None:
+        columns = {row["name"] for row in self._query_all("PRAGMA table_info(chat_messages)")}
+        if "content_html" not in columns:
+            self._execute("ALTER TABLE chat_messages ADD COLUMN content_html TEXT")
+
     def _ensure_default_settings(self) -> None:
         if self.get_setting("subscription_price_rub") is None:
             self.set_setting("subscription_price_rub", "200")
@@ -188,6 +250,11 @@ class Storage:
             self._conn.commit()
             return cur
 
+    def _execute_many(self, sql: str, rows: Iterable[Iterable[Any]]) -> None:
+        with self._lock:
+            self._conn.executemany(sql, rows)
+            self._conn.commit()
+
     def _query_one(self, sql: str, params: Iterable[Any] = ()) -> sqlite3.Row | None:
         with self._lock:
             cur = self._conn.execute(sql, params)
@@ -200,6 +267,9 @@ class Storage:
 
     @staticmethod
     def _json_dumps(data: Any) -> str:
+        if orjson is not None:
+            # Same compact, non-ASCII-escaped text the stdlib call below produces.
+            return orjson.dumps(data).decode("utf-8")
         return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
 
     @staticmethod
@@ -207,9 +277,10 @@ class Storage:
         if not data:
             return {}
         try:
-            return json.loads(data)
+            value = orjson.loads(data) if orjson is not None else json.loads(data)
         except json.JSONDecodeError:
             return {}
+        return value if isinstance(value, dict) else {}
 
     def get_or_create_user(self, chat_id: int) -> User:
         row = self._query_one("SELECT * FROM users WHERE chat_id = ?", (chat_id,))
@@ -299,25 +370,52 @@ class Storage:
     ) -> None:
         payload_meta = self._json_dumps(meta or {})
         timestamp = (created_at or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")
-        self._execute(
-            """
-            INSERT INTO chat_messages (chat_id, role, content, meta, created_at)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (chat_id, role, content, payload_meta, timestamp),
-        )
+        self._execute(_INSERT_CHAT_MESSAGE_SQL, (chat_id, role, content, html.escape(content), payload_meta, timestamp))
 
-    def get_chat_messages(self, chat_id: int, limit: int = 500) -> list[sqlite3.Row]:
-        return self._query_all(
-            """
-            SELECT *
-            FROM chat_messages
-            WHERE chat_id = ?
-            ORDER BY datetime(created_at) ASC, id ASC
-            LIMIT ?
-            """,
-            (chat_id, limit),
-        )
+    def log_chat_messages(
+        self,
+        messages: Iterable[tuple[int, str, str, dict[str, Any] | None]],
+        *,
+        created_at: datetime | None = None,
+    ) -> None:
+        timestamp = (created_at or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")
+        rows = [
+            (chat_id, role, content, html.escape(content), self._json_dumps(meta or {}), timestamp)
+            for chat_id, role, content, meta in messages
+        ]
+        if not rows:
+            return
+        self._execute_many(_INSERT_CHAT_MESSAGE_SQL, rows)
+
+    def count_chat_messages(self, chat_id: int) -> int:
+        row = self._query_one("SELECT COUNT(*) AS cnt FROM chat_messages WHERE chat_id = ?", (chat_id,))
+        return int(row["cnt"]) if row else 0
+
+    def iter_chat_messages(self, chat_id: int, limit: int = 500, batch_size: int = 200) -> Iterator[sqlite3.Row]:
+        remaining = limit
+        last_key: tuple[str, int] | None = None
+
+        while remaining > 0:
+            size = min(batch_size, remaining)
+            if last_key is None:
+                rows = self._query_all(_CHAT_MESSAGES_SQL, (chat_id, size))
+            else:
+                rows = self._query_all(
+                    """
+                    SELECT *
+                    FROM chat_messages
+                    WHERE chat_id = ?
+                      AND (datetime(created_at), id) > (datetime(?), ?)
+                    ORDER BY datetime(created_at) ASC, id ASC
+                    LIMIT ?
+                    """,
+                    (chat_id, last_key[0], last_key[1], size),
+                )
+            yield from rows
+            if len(rows) < size:
+                return
+            last_key = (rows[-1]["created_at"], int(rows[-1]["id"]))
+            remaining -= len(rows)
 
     def get_support_requests(self, limit: int = 200) -> list[dict[str, Any]]:
         rows = self._query_all(
@@ -347,18 +445,77 @@ class Storage:
             )
         return result
 
-    def count_users(self) -> int:
-        row = self._query_one("SELECT COUNT(*) AS cnt FROM users")
-        return int(row["cnt"]) if row else 0
-
-    def get_recipient_ids(
+    def iter_recipient_ids(
         self,
         *,
         subscription: str | None = None,
         active_only: bool = False,
         now: datetime | None = None,
         limit: int | None = None,
-    ) -> list[int]:
+        batch_size: int = 1000,
+    ) -> Iterator[list[int]]:
+        clauses, params = self._recipient_filters(subscription=subscription, active_only=active_only, now=now)
+        remaining = limit if limit is not None and limit > 0 else None
+        last_id: int | None = None
+
+        while remaining is None or remaining > 0:
+            page_clauses = list(clauses)
+            page_params = list(params)
+            if last_id is not None:
+                page_clauses.append("chat_id < ?")
+                page_params.append(last_id)
+
+            where = ""
+            if page_clauses:
+                where = "WHERE " + " AND ".join(page_clauses)
+
+            size = batch_size if remaining is None else min(batch_size, remaining)
+            page_params.append(size)
+            rows = self._query_all(
+                f"""
+                SELECT chat_id
+                FROM users
+                {where}
+                ORDER BY chat_id DESC
+                LIMIT ?
+                """,
+                page_params,
+            )
+            batch = [int(row["chat_id"]) for row in rows]
+            if batch:
+                yield batch
+            if len(batch) < size:
+                return
+            last_id = batch[-1]
+            if remaining is not None:
+                remaining -= len(batch)
+
+    def count_recipients(
+        self,
+        *,
+        subscription: str | None = None,
+        active_only: bool = False,
+        now: datetime | None = None,
+        limit: int | None = None,
+    ) -> int:
+        clauses, params = self._recipient_filters(subscription=subscription, active_only=active_only, now=now)
+        where = ""
+        if clauses:
+            where = "WHERE " + " AND ".join(clauses)
+
+        row = self._query_one(f"SELECT COUNT(*) AS cnt FROM users {where}", params)
+        total = int(row["cnt"]) if row else 0
+        if limit is not None and limit > 0:
+            return min(total, limit)
+        return total
+
+    @staticmethod
+    def _recipient_filters(
+        *,
+        subscription: str | None,
+        active_only: bool,
+        now: datetime | None,
+    ) -> tuple[list[str], list[Any]]:
         clauses: list[str] = []
         params: list[Any] = []
 
@@ -374,87 +531,57 @@ class Storage:
             clauses.append("datetime(subscription_expires_at) >= datetime(?)")
             params.append(now_value)
 
-        where = ""
-        if clauses:
-            where = "WHERE " + " AND ".join(clauses)
+        return clauses, params
 
-        limit_sql = ""
-        if limit is not None and limit > 0:
-            limit_sql = "LIMIT ?"
-            params.append(limit)
-
-        sql = f"""
-            SELECT chat_id
-            FROM users
-            {where}
-            ORDER BY chat_id DESC
-            {limit_sql}
-        """
-        rows = self._query_all(sql, params)
-        return [int(row["chat_id"]) for row in rows]
-
-    def count_new_users_between(self, start: datetime, end: datetime) -> int:
+    def dashboard_summary(self, start: datetime, end: datetime, now: datetime) -> dict[str, int]:
+        start_value = start.strftime("%Y-%m-%d %H:%M:%S")
+        end_value = end.strftime("%Y-%m-%d %H:%M:%S")
+        now_value = now.strftime("%Y-%m-%d %H:%M:%S")
         row = self._query_one(
             """
-            SELECT COUNT(*) AS cnt
+            SELECT
+                (SELECT COUNT(*) FROM users) AS total_users,
+                (
+                    SELECT COUNT(*)
+                    FROM (
+                        SELECT MIN(datetime(created_at)) AS first_seen
+                        FROM chat_messages
+                        GROUP BY chat_id
+                    )
+                    WHERE datetime(first_seen) >= datetime(?) AND datetime(first_seen) < datetime(?)
+                ) AS new_users,
+                (
+                    SELECT COALESCE(SUM(CAST(json_extract(meta, '$.usage.total_tokens') AS INTEGER)), 0)
+                    FROM chat_messages
+                    WHERE role = 'assistant'
+                      AND datetime(created_at) >= datetime(?)
+                      AND datetime(created_at) < datetime(?)
+                      AND json_valid(meta)
+                ) AS tokens,
+                (
+                    SELECT COUNT(*)
+                    FROM users
+                    WHERE subscription = 'paid'
+                      AND subscription_expires_at IS NOT NULL
+                      AND datetime(subscription_expires_at) >= datetime(?)
+                ) AS active_subs,
+                COUNT(p.id) AS paid_count,
+                COALESCE(SUM(p.amount_rub), 0) AS paid_amount
             FROM (
-                SELECT chat_id, MIN(datetime(created_at)) AS first_seen
-                FROM chat_messages
-                GROUP BY chat_id
-            )
-            WHERE datetime(first_seen) >= datetime(?) AND datetime(first_seen) < datetime(?)
-            """,
-            (start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S")),
-        )
-        return int(row["cnt"]) if row else 0
-
-    def count_active_subscriptions(self, now: datetime) -> int:
-        row = self._query_one(
-            """
-            SELECT COUNT(*) AS cnt
-            FROM users
-            WHERE subscription = 'paid'
-              AND subscription_expires_at IS NOT NULL
-              AND datetime(subscription_expires_at) >= datetime(?)
+                SELECT id, amount_rub
+                FROM payments
+                WHERE status = 'succeeded'
+                  AND paid_at IS NOT NULL
+                  AND datetime(paid_at) >= datetime(?)
+                  AND datetime(paid_at) < datetime(?)
+            ) AS p
             """,
-            (now.strftime("%Y-%m-%d %H:%M:%S"),),
-        )
-        return int(row["cnt"]) if row else 0
-
-    def sum_tokens_between(self, start: datetime, end: datetime) -> int:
-        rows = self._query_all(
-            """
-            SELECT meta
-            FROM chat_messages
-            WHERE role = 'assistant'
-              AND datetime(created_at) >= datetime(?)
-              AND datetime(created_at) < datetime(?)
-            """,
-            (start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S")),
-        )
-        total = 0
-        for row in rows:
-            meta = self._json_loads(row["meta"])
-            usage = meta.get("usage") if isinstance(meta, dict) else None
-            if isinstance(usage, dict):
-                total += int(usage.get("total_tokens") or 0)
-        return total
-
-    def payments_summary_between(self, start: datetime, end: datetime) -> tuple[int, int]:
-        row = self._query_one(
-            """
-            SELECT COUNT(*) AS cnt, COALESCE(SUM(amount_rub), 0) AS total
-            FROM payments
-            WHERE status = 'succeeded'
-              AND paid_at IS NOT NULL
-              AND datetime(paid_at) >= datetime(?)
-              AND datetime(paid_at) < datetime(?)
-            """,
-            (start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S")),
+            (start_value, end_value, start_value, end_value, now_value, start_value, end_value),
         )
+        keys = ("total_users", "new_users", "tokens", "active_subs", "paid_count", "paid_amount")
         if not row:
-            return (0, 0)
-        return (int(row["cnt"]), int(row["total"] or 0))
+            return dict.fromkeys(keys, 0)
+        return {key: int(row[key] or 0) for key in keys}
 
     def count_taro_readings(self, chat_id: int, cards_count: int) -> int:
         row = self._query_one(
@@ -668,19 +795,49 @@ class Storage:
     def get_due_reminders(self, now: datetime) -> list[Reminder]:
         rows = self._query_all(
             """
-            SELECT id, chat_id, message, send_at
-            FROM reminders
-            WHERE sent_at IS NULL AND datetime(send_at) <= datetime(?)
+            SELECT r.id, r.chat_id, r.message, r.send_at,
+                   u.subscription AS user_subscription,
+                   u.retention_message_sent_at AS user_retention_sent_at
+            FROM reminders r
+            LEFT JOIN users u ON u.chat_id = r.chat_id
+            WHERE r.sent_at IS NULL AND datetime(r.send_at) <= datetime(?)
             """,
             (now.strftime("%Y-%m-%d %H:%M:%S"),),
         )
-        return [Reminder(id=row["id"], chat_id=row["chat_id"], message=row["message"], send_at=row["send_at"]) for row in rows]
+        return [
+            Reminder(
+                id=row["id"],
+                chat_id=row["chat_id"],
+                message=row["message"],
+                send_at=row["send_at"],
+                user_subscription=row["user_subscription"],
+                user_retention_sent_at=row["user_retention_sent_at"],
+            )
+            for row in rows
+        ]
 
-    def mark_reminder_sent(self, reminder_id: int) -> None:
-        self._execute(
-            "UPDATE reminders SET sent_at = ? WHERE id = ?",
-            (self._now_str(), reminder_id),
-        )
+    def mark_reminders_sent(
+        self,
+        reminder_ids: Iterable[int],
+        *,
+        messages: Iterable[tuple[int, str, str, dict[str, Any] | None]] = (),
+        retention_chat_ids: Iterable[int] = (),
+    ) -> None:
+        now_value = self._now_str()
+        reminder_rows = [(now_value, reminder_id) for reminder_id in reminder_ids]
+        message_rows = [
+            (chat_id, role, content, html.escape(content), self._json_dumps(meta or {}), now_value)
+            for chat_id, role, content, meta in messages
+        ]
+        retention_rows = [(now_value, chat_id) for chat_id in retention_chat_ids]
+        if not (reminder_rows or message_rows or retention_rows):
+            return
+
+        with self._lock:
+            self._conn.executemany(_INSERT_CHAT_MESSAGE_SQL, message_rows)
+            self._conn.executemany("UPDATE users SET retention_message_sent_at = ? WHERE chat_id = ?", retention_rows)
+            self._conn.executemany("UPDATE reminders SET sent_at = ? WHERE id = ?", reminder_rows)
+            self._conn.commit()
 
     def get_setting(self, key: str) -> str | None:
         row = self._query_one("SELECT value FROM app_settings WHERE key = ?", (key,))
@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+import unittest
+from unittest import mock
+
+from services.ai_service import AIService
+
+
+def _events(*texts: str) -> list[dict]:
+    events: list[dict] = [{"model": "m", "choices": [{"delta": {"content": text}}]} for text in texts]
+    events.append({"model": "m", "choices": [], "usage": {"prompt_tokens": 3, "completion_tokens": 9, "total_tokens": 12}})
+    return events
+
+
+class GetAnswerStreamingTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.ai = AIService("key")
+        self.addCleanup(self.ai.close)
+
+    def test_reports_usage(self) -> None:
+        progress: list[str] = []
+        with mock.patch.object(self.ai, "_stream_events", return_value=iter(_events("one ", "two"))):
+            response = self.ai.get_answer_streaming("q", on_progress=progress.append)
+
+        self.assertEqual(response.content, "one two")
+        self.assertEqual(response.usage, {"prompt_tokens": 3, "completion_tokens": 9, "total_tokens": 12})
+        self.assertEqual(progress, ["one ", "one two"])
+
+    def test_truncated_reply_still_reports_usage(self) -> None:
+        progress: list[str] = []
+        with mock.patch.object(self.ai, "_stream_events", return_value=iter(_events("12345", "67890", "abcde"))):
+            response = self.ai.get_answer_streaming("q", on_progress=progress.append, max_chars=6)
+
+        self.assertEqual(response.content, "1234567890")
+        self.assertEqual(response.usage, {"prompt_tokens": 3, "completion_tokens": 9, "total_tokens": 12})
+        self.assertEqual(progress, ["12345", "1234567890"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import unittest
+
+from bot import _ChatDispatcher
+
+
+class ChatDispatcherTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=3)
+        self.dispatcher = _ChatDispatcher(self.executor)
+        self.release = threading.Event()
+
+    def tearDown(self) -> None:
+        self.release.set()
+        self.executor.shutdown(wait=True)
+
+    def drain(self) -> None:
+        while self.dispatcher.pending_updates():
+            self.dispatcher.wait_for_progress(0.1)
+
+    def test_slow_chat_does_not_delay_other_chats(self) -> None:
+        done = threading.Event()
+        # More queued batches for the slow chat than there are workers.
+        for update_id in range(1, 6):
+            self.dispatcher.submit(1, self.release.wait, update_ids=[update_id])
+        self.dispatcher.submit(2, done.set, update_ids=[6])
+
+        self.assertTrue(done.wait(2))
+        self.assertTrue(self.dispatcher.busy(1))
+        self.assertFalse(self.release.is_set())
+
+    def test_keeps_order_within_a_chat(self) -> None:
+        seen: list[int] = []
+        for value in range(20):
+            self.dispatcher.submit(value % 2, seen.append, value, update_ids=[value])
+        self.drain()
+
+        self.assertEqual([value for value in seen if value % 2 == 0], list(range(0, 20, 2)))
+        self.assertEqual([value for value in seen if value % 2 == 1], list(range(1, 20, 2)))
+
+    def test_oldest_pending_update_waits_for_unfinished_handlers(self) -> None:
+        self.dispatcher.submit(1, self.release.wait, update_ids=[10])
+        self.dispatcher.submit(2, lambda: None, update_ids=[11])
+        self.dispatcher.submit(3, lambda: None, update_ids=[12])
+        while self.dispatcher.pending_updates() > 1:
+            self.dispatcher.wait_for_progress(0.1)
+
+        self.assertEqual(self.dispatcher.oldest_pending_update(), 10)
+        self.release.set()
+        self.drain()
+        self.assertIsNone(self.dispatcher.oldest_pending_update())
+        self.assertEqual(self.dispatcher.pending_updates(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+from typing import Callable
+
+from flask import Flask
+
+
+def serve(create_app: Callable[[], Flask], host: str, port: int, workers: int, threads: int) -> None:
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        # gunicorn is POSIX-only; elsewhere fall back to the threaded dev server.
+        create_app().run(host=host, port=port, debug=False, threaded=True)
+        return
+
+    class Server(BaseApplication):
+        def load_config(self) -> None:
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", max(1, workers))
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("threads", max(1, threads))
+
+        def load(self) -> Flask:
+            # Built in each worker after the fork, so per-process state such as SQLite connections is not shared.
+            return create_app()
+
+    Server().run()